@@ -1,26 +1,66 @@
 def main():
     import sys
+    import time
+    import argparse
+    start_time = time.perf_counter()
+
+    # unknown arguments are passed on to Qt
+    parser = argparse.ArgumentParser(prog="viewer")
+    parser.add_argument("--benchmark-startup", action="store_true",
+        help="print the time spent on imports and until the main window is painted, then quit")
+    parser.add_argument("--patch-cache-mb", type=int, default=128,
+        help="memory budget of the cache of recently viewed and prefetched patches in MB")
+    parser.add_argument("--frame-cache-mb", type=int, default=512,
+        help="memory budget of the cache of decoded source frames in MB")
+    args, qt_args = parser.parse_known_args()
 
     from PySide6.QtWidgets import QApplication
+    from PySide6.QtCore import QObject, QEvent, QTimer
 
     from .components.mainwindow import MainController, MainView, MainModel
     from .components.analysis import AnalysisController, AnalysisModel
     from .components.source_frame_ir import SourceFrameControllerIR, SourceFrameModelIR
     from .components.source_frame_rgb import SourceFrameControllerRGB, SourceFrameModelRGB
     from .components.patches import PatchesController, PatchesModel
+    from .components.prefetch import PrefetchController
     from .components.map import MapModel
     from .components.annotation_editor import AnnotationEditorController, AnnotationEditorModel
     from .components.string_editor import StringEditorController, StringEditorModel
     from .components.dataset_settings import DatasetSettingsModel
 
+    import_time = time.perf_counter()
+
+    class StartupBenchmark(QObject):
+        """Reports the time spent on imports and until the main window is painted for the first
+        time, then quits the app. Enabled with the `--benchmark-startup` command line argument."""
+        def __init__(self, app):
+            super().__init__()
+            self.app = app
+            self.painted = False
+
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and not self.painted:
+                self.painted = True
+                QTimer.singleShot(0, self.report)
+            return False
 
+        def report(self):
+            first_paint_time = time.perf_counter()
+            heavy_modules = ["cv2", "pandas", "sklearn", "matplotlib", "pyproj", "networkx"]
+            print("Imports: {:.3f} s".format(import_time - start_time))
+            print("First paint: {:.3f} s".format(first_paint_time - start_time))
+            print("Loaded heavy modules: {}".format(
+                ", ".join([name for name in heavy_modules if name in sys.modules]) or "none"))
+            self.app.quit()
 
     class App(QApplication):
         def __init__(self, sys_argv):
             super(App, self).__init__(sys_argv)
 
             # models
-            self.main_model = MainModel()
+            self.main_model = MainModel(
+                patch_cache_bytes=args.patch_cache_mb*1024**2,
+                frame_cache_bytes=args.frame_cache_mb*1024**2)
             self.main_model.source_frame_model_ir = SourceFrameModelIR()
             self.main_model.source_frame_model_rgb = SourceFrameModelRGB()
             self.main_model.patches_model = PatchesModel()
@@ -35,6 +75,7 @@ def main():
             self.main_controller.source_frame_controller_ir = SourceFrameControllerIR(self.main_model)
             self.main_controller.source_frame_controller_rgb = SourceFrameControllerRGB(self.main_model)
             self.main_controller.patches_controller = PatchesController(self.main_model)
+            self.main_controller.prefetch_controller = PrefetchController(self.main_model, self.main_controller.patches_controller)
             self.main_controller.analysis_controller = AnalysisController(self.main_model)
             self.main_controller.annotation_editor_controller = AnnotationEditorController(self.main_model)
             self.main_controller.string_editor_controller = StringEditorController(self.main_model)
@@ -44,10 +85,13 @@ def main():
             self.main_view.resize(screen.availableSize() * 0.7)
             self.main_view.show()
 
-    app = App(sys.argv)
+    app = App(sys.argv[:1] + qt_args)
+    if args.benchmark_startup:
+        benchmark = StartupBenchmark(app)
+        app.installEventFilter(benchmark)
     sys.exit(app.exec())
 
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,90 @@
+"""Vectorized statistics over the spatial neighbourhood of each module.
+
+The neighbours of all modules within a given radius are computed once and
+stored as a sparse graph in compressed sparse row (CSR) format: the
+neighbours of module `i` are `indices[indptr[i]:indptr[i+1]]`. Statistics of
+the neighbours' values are then evaluated for all modules at once with the
+segmented reductions in `utils.segments`.
+"""
+
+import numpy as np
+
+from ..utils.segments import segment_ids, segment_starts, segment_sort, segment_median
+
+
+class RadiusGraph:
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def from_points(cls, points, radius):
+        """Builds the graph of all points within `radius` of each point in `points` (excluding the point itself)."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            return cls(np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        from sklearn.neighbors import KDTree
+        tree = KDTree(points)
+        neighbor_idxs = tree.query_radius(points, r=radius)
+        lengths = np.array([len(idxs) for idxs in neighbor_idxs], dtype=np.int64)
+        indices = np.concatenate(neighbor_idxs).astype(np.int64)
+        # remove each point from its own neighbours
+        ids = segment_ids(lengths)
+        not_self = indices != ids
+        lengths = np.bincount(ids[not_self], minlength=len(points))
+        indptr = np.zeros(len(points) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        return cls(indptr, indices[not_self])
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.indptr)
+
+    def neighbour_values(self, values):
+        """Returns the values of the neighbours of each point and the number of neighbours
+        per point. NaN values are dropped."""
+        values = np.asarray(values, dtype=np.float64)[self.indices]
+        valid = ~np.isnan(values)
+        lengths = np.bincount(segment_ids(self.lengths)[valid], minlength=len(self))
+        return values[valid], lengths
+
+
+def _trimmed_mean(sorted_values, lengths, proportion):
+    # drop the `proportion` of smallest and largest values of each segment
+    result = np.full(len(lengths), np.nan)
+    cut = np.floor(lengths * proportion).astype(np.int64)
+    kept = lengths - 2 * cut
+    nonempty = kept > 0
+    cumsum = np.concatenate(([0.0], np.cumsum(sorted_values)))
+    starts = segment_starts(lengths)
+    first = starts + cut
+    last = starts + lengths - cut
+    result[nonempty] = (cumsum[last[nonempty]] - cumsum[first[nonempty]]) / kept[nonempty]
+    return result
+
+
+def _mad(sorted_values, lengths):
+    medians = segment_median(sorted_values, lengths)
+    deviations = np.abs(sorted_values - np.repeat(medians, lengths))
+    return segment_median(segment_sort(deviations, lengths), lengths)
+
+
+def neighbour_statistic(graph, values, statistic="median", trim_proportion=0.1):
+    """Computes a statistic of the values of the neighbours of each point in `graph`.
+
+    `statistic` is one of 'median', 'trimmed_mean' (mean after removing `trim_proportion`
+    of the smallest and largest values) or 'mad' (median absolute deviation from the median).
+    NaN values are ignored. Points without neighbours yield NaN.
+    """
+    neighbour_values, lengths = graph.neighbour_values(values)
+    sorted_values = segment_sort(neighbour_values, lengths)
+    if statistic == "median":
+        return segment_median(sorted_values, lengths)
+    elif statistic == "trimmed_mean":
+        return _trimmed_mean(sorted_values, lengths, trim_proportion)
+    elif statistic == "mad":
+        return _mad(sorted_values, lengths)
+    raise ValueError("Unknown neighbour statistic: {}".format(statistic))
@@ -0,0 +1,61 @@
+"""Process pool execution of analyses.
+
+Analyses which process each module independently shard the sorted track_ids
+into small contiguous chunks and process them in a pool of worker processes.
+Results are returned in chunk order, so that concatenating them yields the
+same result as processing all modules serially.
+"""
+
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+
+def split_into_chunks(items, num_workers, chunks_per_worker=16):
+    """Splits `items` into contiguous chunks. Multiple chunks are created per worker
+    to balance load and to allow for a timely cancellation."""
+    chunk_size = max(1, math.ceil(len(items) / (num_workers * chunks_per_worker)))
+    return [items[i:i+chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def map_chunks(func, chunks, args, num_workers, is_cancelled, progress_callback,
+        initializer=None, initargs=()):
+    """Calls `func(chunk, *args)` for each chunk in a pool of `num_workers` processes.
+
+    `is_cancelled` is polled regularly and `progress_callback` is called with the
+    fraction of processed items whenever a chunk is done. Returns the list of
+    results in the order of `chunks` or None if the computation was cancelled.
+    On cancellation, chunks which have not started are dropped and the chunks which
+    are already running are finished before returning.
+    """
+    num_items = sum(len(chunk) for chunk in chunks)
+    num_items_done = 0
+    results = [None] * len(chunks)
+    # spawn processes instead of forking the Qt application
+    mp_context = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(
+        max_workers=num_workers, mp_context=mp_context,
+        initializer=initializer, initargs=initargs)
+    futures = {}
+    try:
+        futures = {executor.submit(func, chunk, *args): i for i, chunk in enumerate(chunks)}
+        pending = set(futures)
+        while len(pending) > 0:
+            if is_cancelled():
+                for future in pending:
+                    future.cancel()
+                return None
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                results[i] = future.result()
+                num_items_done += len(chunks[i])
+                progress_callback(num_items_done / num_items)
+    finally:
+        # waits for the chunks which are already running, so that no orphaned process keeps
+        # reading patches or writing caches after a cancelled run (cancel_futures of shutdown
+        # requires Python 3.9)
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+    return results
@@ -0,0 +1,67 @@
+"""Batched computation of per-patch statistics.
+
+Instead of computing each aggregate of each patch in a separate numpy pass,
+the pixels of a batch of patches are concatenated and sorted once within each
+patch. Minimum, maximum, median and percentiles are then read off the sorted
+pixels, while mean and histograms are computed with segmented reductions.
+"""
+
+import numpy as np
+
+from ..utils.segments import segment_sort, segment_mean, segment_median, \
+    segment_quantile, segment_histogram, segment_starts
+
+
+def percentile_name(percentile):
+    """Returns the column name of a percentile, e.g. 'p5' for the 5th percentile."""
+    return "p{:g}".format(percentile)
+
+
+def compute_patch_stats(patches, percentiles=(), hist_bins=None):
+    """Computes statistics of the raw values of each patch in `patches` in a single pass.
+
+    Returns a dict of arrays with one entry per patch for the columns 'min', 'max',
+    'mean', 'median' and one column for each of the `percentiles` (0 to 100, see
+    `percentile_name`). If the bin edges `hist_bins` are provided, 'hist' contains
+    a histogram of each patch as an array of shape (len(patches), len(hist_bins)-1).
+    """
+    lengths = np.array([patch.size for patch in patches], dtype=np.int64)
+    if len(patches) > 0:
+        values = np.concatenate([np.ravel(patch) for patch in patches])
+    else:
+        values = np.array([], dtype=np.uint16)
+    sorted_values = segment_sort(values, lengths)
+
+    # minimum and maximum are the first and last value of each sorted patch
+    stats = {}
+    nonempty = lengths > 0
+    starts = segment_starts(lengths)[nonempty]
+    stats["min"] = np.full(len(lengths), np.nan)
+    stats["min"][nonempty] = sorted_values[starts]
+    stats["max"] = np.full(len(lengths), np.nan)
+    stats["max"][nonempty] = sorted_values[starts + lengths[nonempty] - 1]
+    stats["mean"] = segment_mean(values, lengths)
+    stats["median"] = segment_median(sorted_values, lengths)
+    for percentile in percentiles:
+        stats[percentile_name(percentile)] = segment_quantile(
+            sorted_values, lengths, percentile / 100)
+    if hist_bins is not None:
+        stats["hist"] = segment_histogram(values, lengths, hist_bins)
+    return stats
+
+
+def stats_table(track_ids, stats):
+    """Concatenates per-module statistics into a columnar table.
+
+    `track_ids` and `stats` are lists with one entry per module. Each entry of
+    `stats` is a dict of equally long arrays (e.g. as returned by `compute_patch_stats`).
+    Returns a dict of arrays with a 'track_id' column and all columns of `stats`.
+    """
+    lengths = [len(next(iter(s.values()))) if len(s) > 0 else 0 for s in stats]
+    table = {"track_id": np.repeat(np.array(track_ids, dtype=object), lengths)}
+    columns = set()
+    for s in stats:
+        columns |= set(s.keys())
+    for column in sorted(columns):
+        table[column] = np.concatenate([s[column] for s in stats if column in s])
+    return table
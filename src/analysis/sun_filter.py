@@ -25,35 +25,36 @@ It works as follows:
 """
 
 import os
-import glob
 import json
-import itertools
-import operator
 import datetime
 import numpy as np
 import cv2
 
 from PySide6.QtCore import QObject, Signal
 
-from ..utils.common import get_immediate_subdirectories, to_celsius
+from ..utils.common import to_celsius
+from ..utils.patch_store import PatchStore, read_patch, list_patch_files
+from ..utils.patch_index import PatchIndex
+from ..utils.feature_cache import PatchFeatureCache
+from ..utils.segments import segment_starts, segment_sort, segment_median
+from .parallel import split_into_chunks, map_chunks
 
 
 
+def get_zero_island_bounds(is_zero):
+    """Returns the start and stop indices of all runs of True in the boolean array `is_zero`."""
+    # run-length encoding: the padded mask changes at the start and stop of each run
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], is_zero, [0])).astype(np.int8)))
+    return edges[0::2], edges[1::2]
+
+
 def get_zero_islands(signal):
     """Get start and stop indices of all zero islands
     in the binary signal sorted after length."""
-    sig = np.copy(signal)
-    idxs = []
-    while len(sig[sig == 0]) > 0:
-        indices = max((list(y)
-            for (x, y)
-            in itertools.groupby((enumerate(sig)), operator.itemgetter(1))
-            if x == 0), key=len)
-        start_idx = indices[0][0]
-        stop_idx = indices[-1][0]
-        sig[start_idx:stop_idx+1] = 1
-        idxs.append((start_idx, stop_idx+1))
-    return idxs
+    starts, stops = get_zero_island_bounds(np.asarray(signal) == 0)
+    # longest islands first, islands of equal length in order of their start
+    order = np.argsort(starts - stops, kind="stable")
+    return list(zip(starts[order].tolist(), stops[order].tolist()))
 
 
 def min_temp_var_segment(max_locs_peaks, max_temps,
@@ -83,39 +84,67 @@ def min_temp_var_segment(max_locs_peaks, max_temps,
     return start_idx, stop_idx
 
 
-def predict_sun_reflections(patch_files, to_celsius_gain, to_celsius_offset, 
-    threshold_temp=5.0, threshold_loc=10.0, threshold_changepoint=10.0, 
-    segment_length_threshold=0.3):
-    if len(patch_files) < 2:
-        return (
-            np.array([], dtype=np.int32), np.array([], dtype=np.float64),
-            np.array([], dtype=np.float64), None, None)
-
+def get_max_features(patch_files, patch_store=None):
+    """Returns the minimum and maximum raw value and the (row, column) location of the maximum
+    of each patch after slight blurring."""
+    min_values = []
+    max_values = []
     max_locs = []
-    max_temps = []
     for patch_file in patch_files:
-        patch = cv2.imread(patch_file, cv2.IMREAD_ANYDEPTH)
+        patch = read_patch(patch_file, patch_store)
 
         # average blur image to prevent noise from affecting
         # the maximum location
         patch = cv2.blur(patch, ksize=(3, 3))
 
-        max_temp = np.max(to_celsius(patch, to_celsius_gain, to_celsius_offset))
-        max_loc = np.unravel_index(np.argmax(patch, axis=None), patch.shape)
+        min_values.append(np.min(patch))
+        max_values.append(np.max(patch))
+        max_locs.append(np.unravel_index(np.argmax(patch, axis=None), patch.shape))
+    return {
+        "min": np.array(min_values, dtype=np.float64),
+        "max": np.array(max_values, dtype=np.float64),
+        "max_loc": np.array(max_locs, dtype=np.int32).reshape(-1, 2),
+    }
+
+
+def get_feature_cache(dataset_dir):
+    return PatchFeatureCache(dataset_dir, "sun_filter", {"blur_ksize": 3})
 
-        max_locs.append(max_loc)
-        max_temps.append(max_temp)
-    max_locs = np.vstack(max_locs).astype(np.float64)
-    max_temps = np.hstack(max_temps)
 
+def get_max_locs_peaks(features, threshold_changepoint):
+    """Returns the binary signal which is one where the location of the maximum moves by at least
+    `threshold_changepoint` pixels between subsequent patches."""
     # compute difference between subsequent max_loc points
-    max_locs_diff = np.diff(max_locs, n=1, axis=0)
+    max_locs_diff = np.diff(features["max_loc"].astype(np.float64), n=1, axis=0)
     max_locs_diff = np.linalg.norm(max_locs_diff, axis=1)
 
     # find peaks in the difference signal
     max_locs_peaks = np.zeros(max_locs_diff.shape, dtype=np.int32)
     max_locs_peaks[max_locs_diff >= threshold_changepoint] = 1
     max_locs_peaks[max_locs_diff < threshold_changepoint] = 0
+    return max_locs_peaks
+
+
+def predict_sun_reflections(patch_files, to_celsius_gain, to_celsius_offset, 
+    threshold_temp=5.0, threshold_loc=10.0, threshold_changepoint=10.0, 
+    segment_length_threshold=0.3, patch_store=None, features=None):
+    """Predicts which of the `patch_files` of a module contain a sun reflection. The `features`
+    of the patches (see `get_max_features`) are computed if not provided. To predict the sun
+    reflections of many modules use `SunFilterFeatures.predict`, which gives the same result."""
+    if len(patch_files) < 2:
+        return (
+            np.array([], dtype=np.int32), np.array([], dtype=np.float64),
+            np.array([], dtype=np.float64), None, None)
+
+    if features is None:
+        features = get_max_features(patch_files, patch_store)
+    max_locs = features["max_loc"].astype(np.float64)
+    # the maximum temperature is attained at the minimum raw value if the gain is negative
+    max_temps = np.maximum(
+        to_celsius(features["max"], to_celsius_gain, to_celsius_offset),
+        to_celsius(features["min"], to_celsius_gain, to_celsius_offset))
+
+    max_locs_peaks = get_max_locs_peaks(features, threshold_changepoint)
 
     # find start and stop index of the segment of zeros which
     # is sufficiently long and has smallest temperature variance
@@ -142,6 +171,220 @@ def predict_sun_reflections(patch_files, to_celsius_gain, to_celsius_offset,
         distances_temp, start_idx, stop_idx)
 
 
+# state of the worker processes in parallel mode
+_process_patch_store = None
+_process_feature_cache = None
+_process_patch_index = None
+
+
+def _init_process(dataset_dir, patch_dir):
+    global _process_patch_store, _process_feature_cache, _process_patch_index
+    _process_patch_store = PatchStore.open(dataset_dir, patch_dir)
+    _process_patch_index = PatchIndex.open(dataset_dir, patch_dir)
+    _process_feature_cache = get_feature_cache(dataset_dir)
+
+
+def _get_max_features_chunk(plant_ids, patch_dir):
+    patch_files_list = []
+    features_list = []
+    for plant_id in plant_ids:
+        patch_files = list_patch_files(patch_dir, plant_id, _process_patch_store, _process_patch_index)
+        patch_files_list.append(patch_files)
+        features_list.append(_process_feature_cache.get_or_compute(
+            plant_id, patch_files, lambda patch_files: get_max_features(patch_files, _process_patch_store)))
+    # new cache entries are merged and saved by the main process
+    return patch_files_list, features_list, _process_feature_cache.take_updates()
+
+
+
+class SunFilterFeatures:
+    """Patch files and features (see `get_max_features`) of all modules of a dataset. The features
+    are extracted once, after which the sun reflections can be predicted for any thresholds without
+    reading patches again. The features of all modules are concatenated, so that the prediction is
+    vectorized over the whole dataset."""
+    def __init__(self, plant_ids, patch_files_list, features_list):
+        self.plant_ids = plant_ids
+        self.patch_files_list = patch_files_list
+        self.num_patches_per_module = np.array([len(patch_files) for patch_files in patch_files_list], dtype=np.int64)
+        self.offsets = np.zeros(len(plant_ids) + 1, dtype=np.int64)
+        np.cumsum(self.num_patches_per_module, out=self.offsets[1:])
+        self.num_patches = int(self.offsets[-1])
+        self.module_idxs = np.repeat(np.arange(len(plant_ids)), self.num_patches_per_module)
+        self.min_values = np.concatenate([features["min"] for features in features_list] + [np.zeros(0)])
+        self.max_values = np.concatenate([features["max"] for features in features_list] + [np.zeros(0)])
+        self.max_locs = np.concatenate(
+            [features["max_loc"].astype(np.float64) for features in features_list] + [np.zeros((0, 2))])
+
+    def predict_flags(self, to_celsius_gain, to_celsius_offset, threshold_temp=5.0, threshold_loc=10.0, 
+        threshold_changepoint=10.0, segment_length_threshold=0.3):
+        """Returns a boolean array which is True for all patches with sun reflection. Same as
+        `predict_sun_reflections` for each module."""
+        lengths = self.num_patches_per_module
+        max_temps = np.maximum(
+            to_celsius(self.max_values, to_celsius_gain, to_celsius_offset),
+            to_celsius(self.min_values, to_celsius_gain, to_celsius_offset))
+
+        # zero islands of the peak signal of all modules, the element i of the signal compares patch i
+        # and i+1, so islands start at the index of a patch and never span two modules
+        max_locs_diff = np.linalg.norm(np.diff(self.max_locs, n=1, axis=0), axis=1)
+        is_zero = ~(max_locs_diff >= threshold_changepoint)
+        module_starts = self.offsets[1:-1]
+        is_zero[module_starts[(module_starts > 0) & (module_starts < self.num_patches)] - 1] = False
+        starts, stops = get_zero_island_bounds(is_zero)
+        island_modules = self.module_idxs[starts]
+        order = np.lexsort((starts, starts - stops, island_modules))
+        starts, stops, island_modules = starts[order], stops[order], island_modules[order]
+
+        # select the longest island of each module or, if several islands are longer than the
+        # segment_length_threshold, the one with the lowest temperature variance
+        is_candidate = (stops - starts) / (lengths[island_modules] - 1) > segment_length_threshold
+        num_candidates = np.bincount(island_modules[is_candidate], minlength=len(lengths))
+        first_islands = np.searchsorted(island_modules, np.arange(len(lengths)))
+        chosen = first_islands.copy()
+        for module_idx in np.flatnonzero(num_candidates > 1):
+            candidates = range(first_islands[module_idx], first_islands[module_idx] + num_candidates[module_idx])
+            segment_vars = [np.var(max_temps[starts[i]:stops[i]]) for i in candidates]
+            chosen[module_idx] = candidates[np.argmin(segment_vars)]
+
+        # modules without islands use all patches, modules with less than two patches are skipped
+        has_island = np.zeros(len(lengths), dtype=bool)
+        has_island[island_modules] = True
+        is_valid = lengths >= 2
+        chosen_starts = self.offsets[:-1].copy()
+        chosen_stops = self.offsets[1:].copy()
+        chosen_starts[has_island] = starts[chosen[has_island]]
+        chosen_stops[has_island] = stops[chosen[has_island]] + 1
+        chosen_starts = chosen_starts[is_valid]
+        chosen_lengths = chosen_stops[is_valid] - chosen_starts
+
+        # gather the chosen segments and compute their median location point and median temperature
+        idxs = np.arange(np.sum(chosen_lengths)) + np.repeat(
+            chosen_starts - segment_starts(chosen_lengths), chosen_lengths)
+        median = lambda values: segment_median(segment_sort(values[idxs], chosen_lengths), chosen_lengths)
+        center_locs = np.zeros((len(lengths), 2))
+        center_temps = np.zeros(len(lengths))
+        center_locs[is_valid, 0] = median(self.max_locs[:, 0])
+        center_locs[is_valid, 1] = median(self.max_locs[:, 1])
+        center_temps[is_valid] = median(max_temps)
+
+        # determine patches for which one of the two criteria is not met
+        distances_loc = np.linalg.norm(self.max_locs - center_locs[self.module_idxs], axis=1)
+        distances_temp = np.abs(max_temps - center_temps[self.module_idxs])
+        flags = (distances_temp > threshold_temp) | (distances_loc > threshold_loc)
+        return flags & is_valid[self.module_idxs]
+
+    def predict(self, *args, **kwargs):
+        """Returns the indices of the patches with sun reflection of each module. Arguments are the
+        same as for `predict_flags`."""
+        flags = self.predict_flags(*args, **kwargs)
+        return [np.flatnonzero(flags[start:stop]).astype(np.int32) for start, stop in zip(self.offsets[:-1], self.offsets[1:])]
+
+    def get_sun_reflections(self, *args, **kwargs):
+        """Returns the names of the patches with sun reflection of each module as stored in
+        `sun_filter.json`. Arguments are the same as for `predict_flags`."""
+        sun_reflections = {}
+        patch_idxs_list = self.predict(*args, **kwargs)
+        for plant_id, patch_files, patch_idxs_sun_reflections in zip(self.plant_ids, self.patch_files_list, patch_idxs_list):
+            sun_reflections[plant_id] = [
+                os.path.splitext(os.path.basename(patch_files[i]))[0] 
+                for i in patch_idxs_sun_reflections.tolist()
+            ]
+        return sun_reflections
+
+
+def load_features_serial(dataset_dir, patch_dir, patch_index, is_cancelled, progress_callback):
+    """Returns the `SunFilterFeatures` of all modules in `patch_index` or None if cancelled. Features
+    are taken from the feature cache or computed. Arguments are the same as for `map_chunks`."""
+    patch_store = PatchStore.open(dataset_dir, patch_dir)
+    feature_cache = get_feature_cache(dataset_dir)
+    plant_ids = patch_index.track_ids
+    patch_files_list = []
+    features_list = []
+    for i, plant_id in enumerate(plant_ids):
+        if is_cancelled():
+            feature_cache.save()
+            return None
+
+        patch_files = list_patch_files(patch_dir, plant_id, patch_store, patch_index)
+        features = feature_cache.get_or_compute(
+            plant_id, patch_files, lambda patch_files: get_max_features(patch_files, patch_store))
+        patch_files_list.append(patch_files)
+        features_list.append(features)
+
+        progress_callback(i / len(plant_ids))
+    feature_cache.save()
+    return SunFilterFeatures(plant_ids, patch_files_list, features_list)
+
+
+def load_features_parallel(dataset_dir, patch_dir, patch_index, num_workers, is_cancelled, progress_callback):
+    """Same as `load_features_serial`, but computed by a pool of `num_workers` processes."""
+    plant_ids = patch_index.track_ids
+    chunks = split_into_chunks(plant_ids, num_workers)
+    results = map_chunks(
+        _get_max_features_chunk,
+        chunks,
+        (patch_dir,),
+        num_workers,
+        is_cancelled,
+        progress_callback,
+        initializer=_init_process,
+        initargs=(dataset_dir, patch_dir))
+    if results is None:
+        return None
+
+    feature_cache = get_feature_cache(dataset_dir)
+    patch_files_list = []
+    features_list = []
+    for chunk_patch_files, chunk_features, cache_updates in results:
+        patch_files_list.extend(chunk_patch_files)
+        features_list.extend(chunk_features)
+        feature_cache.merge(cache_updates)
+    feature_cache.save()
+    return SunFilterFeatures(plant_ids, patch_files_list, features_list)
+
+
+def load_features(dataset_dir, patch_dir, num_workers, is_cancelled, progress_callback):
+    patch_index = PatchIndex.open(dataset_dir, patch_dir)
+    if num_workers > 1:
+        return load_features_parallel(dataset_dir, patch_dir, patch_index, num_workers, is_cancelled, progress_callback)
+    return load_features_serial(dataset_dir, patch_dir, patch_index, is_cancelled, progress_callback)
+
+
+
+class SunFilterFeaturesWorker(QObject):
+    """Loads the `SunFilterFeatures` of a dataset, e.g. to preview the sun filter for different thresholds."""
+    finished = Signal()
+    progress = Signal(float, bool, str)
+    loaded = Signal(object)
+
+    def __init__(self, dataset_dir, dataset_version, num_workers=1):
+        super().__init__()
+        self.is_cancelled = False
+        self.dataset_dir = dataset_dir
+        self.dataset_version = dataset_version
+        self.num_workers = num_workers
+        self.progress_last_step = 0.0
+
+    def report_progress(self, progress):
+        self.progress_last_step = progress
+        self.progress.emit(progress, False, "Loading patch features...")
+
+    def run(self):
+        if self.dataset_version == "v1":
+            patch_dir = os.path.join(self.dataset_dir, "patches_final", "radiometric")
+        elif self.dataset_version == "v2":
+            patch_dir = os.path.join(self.dataset_dir, "patches", "radiometric")
+
+        if os.path.isdir(patch_dir):
+            features = load_features(
+                self.dataset_dir, patch_dir, self.num_workers, lambda: self.is_cancelled, self.report_progress)
+            if features is None:
+                self.progress.emit(self.progress_last_step, True, "Cancelled")
+            else:
+                self.loaded.emit(features)
+        self.finished.emit()
+
+
 
 class AnalysisSunFilterWorker(QObject):
     finished = Signal()
@@ -149,7 +392,7 @@ class AnalysisSunFilterWorker(QObject):
 
     def __init__(self, dataset_dir, dataset_version, name, to_celsius_gain, 
             to_celsius_offset, threshold_temp, threshold_loc, threshold_changepoint, 
-            segment_length_threshold):
+            segment_length_threshold, num_workers=1, features=None):
         super().__init__()
         self.is_cancelled = False
         self.timestamp = datetime.datetime.utcnow().isoformat()
@@ -162,6 +405,13 @@ class AnalysisSunFilterWorker(QObject):
         self.threshold_loc = threshold_loc
         self.threshold_changepoint = threshold_changepoint
         self.segment_length_threshold = segment_length_threshold
+        self.num_workers = num_workers
+        self.features = features  # features loaded in advance (optional)
+        self.progress_last_step = 0.0
+
+    def report_progress(self, progress):
+        self.progress_last_step = progress
+        self.progress.emit(progress, False, "Filtering module images with sun reflections...")
 
     def run(self):
         if self.dataset_version == "v1":
@@ -172,36 +422,23 @@ class AnalysisSunFilterWorker(QObject):
         if not os.path.isdir(patch_dir):
             return None
 
-        sun_reflections = {}
-        plant_ids = sorted(get_immediate_subdirectories(patch_dir))
-        for i, plant_id in enumerate(plant_ids):
-
-            progress = i / len(plant_ids)
-            if self.is_cancelled:
-                self.progress.emit(progress, True, "Cancelled")
-                self.finished.emit()
-                return
-
-            patch_files = sorted(glob.glob(
-                os.path.join(patch_dir, plant_id, "*")))
-            patch_idxs_sun_reflections, _, _, _, _ = predict_sun_reflections(
-                patch_files, 
-                self.to_celsius_gain,
-                self.to_celsius_offset,
-                self.threshold_temp, 
-                self.threshold_loc,
-                self.threshold_changepoint,
-                self.segment_length_threshold)
-            
-            sun_reflections[plant_id] = [
-                os.path.splitext(os.path.basename(patch_file))[0] 
-                for i, patch_file 
-                in enumerate(patch_files) 
-                if i in patch_idxs_sun_reflections
-            ]
+        features = self.features
+        if features is None:
+            features = load_features(
+                self.dataset_dir, patch_dir, self.num_workers, lambda: self.is_cancelled, self.report_progress)
+        if features is None:
+            self.progress.emit(self.progress_last_step, True, "Cancelled")
+            self.finished.emit()
+            return
+
+        sun_reflections = features.get_sun_reflections(
+            self.to_celsius_gain,
+            self.to_celsius_offset,
+            self.threshold_temp, 
+            self.threshold_loc,
+            self.threshold_changepoint,
+            self.segment_length_threshold)
 
-            self.progress.emit(progress, False, "Filtering module images with sun reflections...")
-        
         save_path = os.path.join(self.dataset_dir, "analyses", self.name)
         save_file = os.path.join(save_path, "sun_filter.json")
         print("Saving sun filter results in {}".format(save_file))
@@ -1,17 +1,18 @@
 import os
-import glob
 import json
 import datetime
-from collections import defaultdict
-import cv2
 import numpy as np
-import pandas as pd
-from sklearn.neighbors import KDTree
 
 from PySide6.QtCore import QObject, Signal
 
-from ..utils.common import get_immediate_subdirectories, to_celsius
-from ..utils.geojson import load_geojson, save_geojson, coords_wgs84_to_ltp
+from ..utils.common import to_celsius
+from ..utils.patch_store import PatchStore, read_patch, list_patch_files
+from ..utils.patch_index import PatchIndex
+from ..utils.feature_cache import PatchFeatureCache, get_patch_names
+from ..utils.geojson import load_geojson, save_geojson_file, coords_wgs84_to_ltp
+from .patch_statistics import compute_patch_stats, stats_table
+from .parallel import split_into_chunks, map_chunks
+from .neighbourhood import RadiusGraph, neighbour_statistic
 
 
 def load_modules(file):
@@ -30,34 +31,91 @@ def truncate_patch(patch, margin=0.05):
     return patch
 
 
-def remove_patches_with_sun_reflection(patch_files, sun_reflections):
-    """Returns a copy of the patch_files list withput patches that contain a sun reflections as per 'sun_reflections'."""
-    patch_files_filtered = []
+def get_patch_features(patch_files, margin, patch_store=None, percentiles=()):
+    """Returns min, max, mean and median raw values (and optionally percentiles) for each patch of a module
+    after truncating the borders. Unreadable patches yield NaN."""
+    patches = []
     for patch_file in patch_files:
-        patch_name = os.path.splitext(os.path.basename(patch_file))[0]
-        if patch_name not in sun_reflections:
-            patch_files_filtered.append(patch_file)
-    return patch_files_filtered
+        patch = read_patch(patch_file, patch_store)
+        if patch is not None:
+            patches.append(truncate_patch(patch, margin))
+        else:
+            patches.append(np.array([], dtype=np.uint16))
+    return compute_patch_stats(patches, percentiles)
 
 
-def get_patch_temps(patch_files, margin, to_celsius_gain, to_celsius_offset):
-    """Returns min, max, mean and median temperatures for each patch of a module."""
-    temps = defaultdict(list)
-    for patch_file in patch_files:
-        patch = cv2.imread(patch_file, cv2.IMREAD_ANYDEPTH)
-        if patch is not None:
-            patch = truncate_patch(patch, margin)
-            temps["min"].append(to_celsius(np.min(patch), to_celsius_gain, to_celsius_offset))
-            temps["max"].append(to_celsius(np.max(patch), to_celsius_gain, to_celsius_offset))
-            temps["mean"].append(to_celsius(np.mean(patch), to_celsius_gain, to_celsius_offset))
-            temps["median"].append(to_celsius(np.median(patch), to_celsius_gain, to_celsius_offset))
+def get_patch_temps(patch_files, margin, to_celsius_gain, to_celsius_offset, patch_store=None, percentiles=(), 
+        feature_cache=None, track_id=None):
+    """Returns min, max, mean and median temperatures (and optionally percentiles) for each patch of a module.
+    The result is a dict of arrays with one entry per readable patch and the patch names in the 'patch' column.
+    If a `feature_cache` is provided, the raw values of the patches of module `track_id` are cached."""
+    compute_features = lambda patch_files: get_patch_features(patch_files, margin, patch_store, percentiles)
+    if feature_cache is not None:
+        features = feature_cache.get_or_compute(track_id, patch_files, compute_features)
+    else:
+        features = compute_features(patch_files)
+    readable = ~np.isnan(features["min"])
+    temps = {
+        column: to_celsius(values[readable], to_celsius_gain, to_celsius_offset) 
+        for column, values in features.items()
+    }
+    temps["patch"] = get_patch_names(patch_files)[readable].astype(object)
     return temps
 
 
-def mean_over_patches(dataframe, temps):
+def remove_patches_with_sun_reflection(temps, sun_reflections):
+    """Returns a copy of the patch temperatures without patches that contain a sun reflections as per 'sun_reflections'."""
+    keep = ~np.isin(temps["patch"], list(sun_reflections))
+    return {column: values[keep] for column, values in temps.items()}
+
+
+def mean_over_patches(dataframe, patch_temps):
     """Compute the mean of the module temperatures over all patches of a module."""
-    for patch_area_agg in ["min", "max", "mean", "median"]:
-        dataframe["{}_temp".format(patch_area_agg)] = pd.Series({track_id: np.mean(t[patch_area_agg]) for track_id, t in temps.items()})
+    patch_area_aggs = ["min", "max", "mean", "median"]
+    module_temps = patch_temps.groupby("track_id")[patch_area_aggs].mean()
+    for patch_area_agg in patch_area_aggs:
+        dataframe["{}_temp".format(patch_area_agg)] = module_temps[patch_area_agg]
+
+
+def get_module_patch_temps(track_id, patches_dir, margin, to_celsius_gain, to_celsius_offset, sun_reflections=None, 
+        patch_store=None, feature_cache=None, patch_index=None):
+    """Returns the temperatures of all patches of module `track_id` (see `get_patch_temps`). If `sun_reflections`
+    is provided, patches with sun reflections are ignored."""
+    patch_files = list_patch_files(patches_dir, track_id, patch_store, patch_index)
+    temps = get_patch_temps(patch_files, margin, to_celsius_gain, to_celsius_offset, patch_store, 
+        feature_cache=feature_cache, track_id=track_id)
+    if sun_reflections is not None:
+        temps = remove_patches_with_sun_reflection(temps, sun_reflections[track_id])
+    return temps
+
+
+def get_feature_cache(dataset_dir, margin):
+    return PatchFeatureCache(dataset_dir, "patch_temps", {"margin": margin})
+
+
+# state of the worker processes in parallel mode
+_process_patch_store = None
+_process_feature_cache = None
+_process_sun_reflections = None
+_process_patch_index = None
+
+
+def _init_process(dataset_dir, patches_dir, margin, sun_reflections):
+    global _process_patch_store, _process_feature_cache, _process_sun_reflections, _process_patch_index
+    _process_patch_store = PatchStore.open(dataset_dir, patches_dir)
+    _process_patch_index = PatchIndex.open(dataset_dir, patches_dir)
+    _process_feature_cache = get_feature_cache(dataset_dir, margin)
+    _process_sun_reflections = sun_reflections
+
+
+def _get_patch_temps_chunk(track_ids, patches_dir, margin, to_celsius_gain, to_celsius_offset):
+    temps = [
+        get_module_patch_temps(track_id, patches_dir, margin, to_celsius_gain, to_celsius_offset,
+            _process_sun_reflections, _process_patch_store, _process_feature_cache, _process_patch_index)
+        for track_id in track_ids
+    ]
+    # new cache entries are merged and saved by the main process
+    return temps, _process_feature_cache.take_updates()
 
 
 class AnalysisModuleTemperaturesWorker(QObject):
@@ -65,7 +123,7 @@ class AnalysisModuleTemperaturesWorker(QObject):
     progress = Signal(float, bool, str)
 
     def __init__(self, dataset_dir, dataset_version, name, to_celsius_gain, to_celsius_offset, 
-            border_margin, neighbour_radius, ignore_sun_reflections, sun_reflections):
+            border_margin, neighbour_radius, ignore_sun_reflections, sun_reflections, num_workers=1):
         super().__init__()
         self.is_cancelled = False
         self.timestamp = datetime.datetime.utcnow().isoformat()
@@ -78,34 +136,80 @@ class AnalysisModuleTemperaturesWorker(QObject):
         self.neighbour_radius = neighbour_radius
         self.ignore_sun_reflections = ignore_sun_reflections
         self.sun_reflections = sun_reflections
+        self.num_workers = num_workers
         self.progress_last_step = 0.0
 
-    def get_neighbours_median_temp(self, df_centers, neighbour_radius=7, column="mean_of_max_temps"):
-        """Returns a list of mean temperatures of the neighbours of each module in `df_centers`.
-        The `neighbour_radius` defines the circle radius in which to look for neighbouring modules.
-        The `column` specifies which temperature column to use."""
+    def get_neighbours_median_temps(self, df_centers, neighbour_radius=7, columns=("mean_of_max_temps",)):
+        """Returns a dict with the median temperatures of the neighbours of each module in `df_centers`
+        for each of the temperature `columns`. The `neighbour_radius` defines the circle radius in which
+        to look for neighbouring modules."""
         centers = np.array([[d["coordinates"][0], d["coordinates"][1]] for d in df_centers["geometry"]])
-        tree = KDTree(centers)
-        neighbor_idxs = tree.query_radius(centers, r=neighbour_radius)
-        
-        # get mean temperature of neighbors
-        neighbour_mean_temps = []
-        for row_idx, neighbor_idx in enumerate(neighbor_idxs):
-            progress = self.progress_last_step + (row_idx / len(neighbor_idxs)) / 5
+        graph = RadiusGraph.from_points(centers, neighbour_radius)
+
+        neighbour_median_temps = {}
+        for i, column in enumerate(columns):
+            progress = self.progress_last_step + (i / len(columns)) * 4 / 5
+            if self.is_cancelled:
+                self.progress.emit(progress, True, "Cancelled")
+                self.finished.emit()
+                return
+            self.progress.emit(progress, False, "Computing corrected {}...".format(" ".join(column.split("_"))))
+            neighbour_median_temps[column] = neighbour_statistic(graph, df_centers[column].values, "median")
+        self.progress_last_step = 1.0
+        return neighbour_median_temps
+
+    def get_patch_temps_serial(self, patches_dir, track_ids, sun_reflections, patch_index=None):
+        """Returns the patch temperatures of each module in `track_ids`."""
+        patch_store = PatchStore.open(self.dataset_dir, patches_dir)
+        feature_cache = get_feature_cache(self.dataset_dir, self.border_margin)
+        temps = []
+        for i, track_id in enumerate(track_ids):
+            progress = (i / len(track_ids)) / 5
             if self.is_cancelled:
+                feature_cache.save()
                 self.progress.emit(progress, True, "Cancelled")
                 self.finished.emit()
                 return
 
-            neighbor_idx = np.delete(neighbor_idx, np.nonzero(neighbor_idx == row_idx))  # remove the current module from list of neighbors
-            mean_temp = df_centers.iloc[neighbor_idx][column].median()
-            neighbour_mean_temps.append(mean_temp)
+            temps.append(get_module_patch_temps(track_id, patches_dir, self.border_margin, 
+                self.to_celsius_gain, self.to_celsius_offset, sun_reflections, patch_store, feature_cache, patch_index))
 
-            self.progress.emit(progress, False, "Computing corrected {}...".format(" ".join(column.split("_"))))
-        self.progress_last_step = progress
-        return neighbour_mean_temps
+            self.progress.emit(progress, False, "Computing temperature distribution...")
+        feature_cache.save()
+        return temps
+
+    def get_patch_temps_parallel(self, patches_dir, track_ids, sun_reflections):
+        """Returns the patch temperatures of each module in `track_ids` computed by a pool of `num_workers` processes."""
+        def report_progress(progress):
+            self.progress_last_step = progress / 5
+            self.progress.emit(self.progress_last_step, False, "Computing temperature distribution...")
+
+        chunks = split_into_chunks(track_ids, self.num_workers)
+        results = map_chunks(
+            _get_patch_temps_chunk,
+            chunks,
+            (patches_dir, self.border_margin, self.to_celsius_gain, self.to_celsius_offset),
+            self.num_workers,
+            lambda: self.is_cancelled,
+            report_progress,
+            initializer=_init_process,
+            initargs=(self.dataset_dir, patches_dir, self.border_margin, sun_reflections))
+        if results is None:
+            self.progress.emit(self.progress_last_step, True, "Cancelled")
+            self.finished.emit()
+            return
+
+        feature_cache = get_feature_cache(self.dataset_dir, self.border_margin)
+        temps = []
+        for chunk_temps, cache_updates in results:
+            temps.extend(chunk_temps)
+            feature_cache.merge(cache_updates)
+        feature_cache.save()
+        return temps
 
     def run(self):
+        import pandas as pd
+
         if self.dataset_version == "v1":
             patches_dir = os.path.join(self.dataset_dir, "patches_final", "radiometric")
         elif self.dataset_version == "v2":
@@ -114,34 +218,31 @@ class AnalysisModuleTemperaturesWorker(QObject):
         file = os.path.join(self.dataset_dir, "mapping", "module_geolocations_refined.geojson")
         df, df_corners, df_centers = load_modules(file)
 
-        temps = {}
-        track_ids = sorted(get_immediate_subdirectories(patches_dir))
-        for i, track_id in enumerate(track_ids):
-            progress = (i / len(track_ids)) / 5
-            if self.is_cancelled:
-                self.progress.emit(progress, True, "Cancelled")
-                self.finished.emit()
-                return
+        sun_reflections = None
+        if self.ignore_sun_reflections and self.sun_reflections is not None:
+            sun_reflections = self.sun_reflections
+        patch_index = PatchIndex.open(self.dataset_dir, patches_dir)
+        track_ids = patch_index.track_ids
+        if self.num_workers > 1:
+            temps = self.get_patch_temps_parallel(patches_dir, track_ids, sun_reflections)
+        else:
+            temps = self.get_patch_temps_serial(patches_dir, track_ids, sun_reflections, patch_index)
+        if temps is None: # cancelled
+            return
+        self.progress_last_step = 1 / 5
 
-            patch_files = sorted(glob.glob(os.path.join(patches_dir, track_id, "*")))
-            if self.ignore_sun_reflections and self.sun_reflections is not None:
-                patch_files = remove_patches_with_sun_reflection(patch_files, self.sun_reflections[track_id])
-            temps[track_id] = get_patch_temps(patch_files, self.border_margin, self.to_celsius_gain, self.to_celsius_offset)
+        patch_temps = pd.DataFrame(stats_table(track_ids, temps))
+        mean_over_patches(df_corners, patch_temps)
+        mean_over_patches(df_centers, patch_temps)
 
-            self.progress.emit(progress, False, "Computing temperature distribution...")
-        self.progress_last_step = progress
-                
-        mean_over_patches(df_corners, temps)
-        mean_over_patches(df_centers, temps)
-
-        for patch_area_agg in ["min", "max", "mean", "median"]:
-            column = "{}_temp".format(patch_area_agg)
-            neighbour_mean_temps = self.get_neighbours_median_temp(df_centers, neighbour_radius=self.neighbour_radius, column=column)
-            if neighbour_mean_temps is None: # cancelled
-                return
+        columns = ["{}_temp".format(patch_area_agg) for patch_area_agg in ["min", "max", "mean", "median"]]
+        neighbour_median_temps = self.get_neighbours_median_temps(df_centers, neighbour_radius=self.neighbour_radius, columns=columns)
+        if neighbour_median_temps is None: # cancelled
+            return
 
-            df_corners["{}_corrected".format(column)] = df_corners.loc[:, column] - neighbour_mean_temps
-            df_centers["{}_corrected".format(column)] = df_centers.loc[:, column] - neighbour_mean_temps
+        for column in columns:
+            df_corners["{}_corrected".format(column)] = df_corners.loc[:, column] - neighbour_median_temps[column]
+            df_centers["{}_corrected".format(column)] = df_centers.loc[:, column] - neighbour_median_temps[column]
 
         # merge back into single geodataframe
         df_merged = df_corners.append(df_centers)
@@ -159,7 +260,7 @@ class AnalysisModuleTemperaturesWorker(QObject):
         save_file = os.path.join(save_path, "results.geojson")
         print("Saving module temperature results in {}".format(save_file))
         os.makedirs(save_path, exist_ok=True)
-        save_geojson(df_merged, open(save_file, "w"))
+        save_geojson_file(df_merged, save_file)
 
         print("Saving meta json in {}".format(os.path.join(save_path, "meta.json")))
         meta = {
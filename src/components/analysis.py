@@ -1,12 +1,11 @@
 
+import os
 import datetime
 
-from PySide6.QtWidgets import QWidget, QMessageBox
+from PySide6.QtWidgets import QWidget, QMessageBox, QSpinBox, QLabel, QPushButton
 from PySide6.QtCore import Qt, Slot, QThread, Slot, Signal, QObject
 
 from ..ui.ui_analysis import Ui_Analysis
-from ..analysis.temperatures import AnalysisModuleTemperaturesWorker
-from ..analysis.sun_filter import AnalysisSunFilterWorker
 
 
 class AnalysisView(QWidget):
@@ -18,6 +17,26 @@ class AnalysisView(QWidget):
         self.parent = parent
         self.ui = Ui_Analysis()
         self.ui.setupUi(self)
+        self.spinBoxNumWorkers = QSpinBox(self.ui.tabModuleTemperatures)
+        self.spinBoxNumWorkers.setMinimum(1)
+        self.spinBoxNumWorkers.setMaximum(max(1, os.cpu_count() or 1))
+        self.spinBoxNumWorkers.setToolTip("Number of processes used to compute patch temperatures")
+        self.ui.formLayout.addRow("Worker processes", self.spinBoxNumWorkers)
+        self.labelSunFilterNumWorkers = QLabel("Worker processes", self.ui.tabSunFilter)
+        self.spinBoxSunFilterNumWorkers = QSpinBox(self.ui.tabSunFilter)
+        self.spinBoxSunFilterNumWorkers.setMinimum(1)
+        self.spinBoxSunFilterNumWorkers.setMaximum(max(1, os.cpu_count() or 1))
+        self.spinBoxSunFilterNumWorkers.setToolTip("Number of processes used to filter the patches")
+        row = self.ui.gridLayout.rowCount()
+        self.ui.gridLayout.addWidget(self.labelSunFilterNumWorkers, row, 0, 1, 1)
+        self.ui.gridLayout.addWidget(self.spinBoxSunFilterNumWorkers, row, 1, 1, 1)
+        self.labelSunFilterPreview = QLabel(self.ui.tabSunFilter)
+        self.labelSunFilterPreview.setToolTip("Number of patches flagged with the current thresholds")
+        self.pushButtonSunFilterPreview = QPushButton("Preview", self.ui.tabSunFilter)
+        self.pushButtonSunFilterPreview.setToolTip(
+            "Extract the features of all patches once and show the number of flagged patches while changing the thresholds")
+        self.ui.gridLayout.addWidget(self.labelSunFilterPreview, row + 1, 0, 1, 1)
+        self.ui.gridLayout.addWidget(self.pushButtonSunFilterPreview, row + 1, 1, 1, 1)
         self.reset()
         # connect signals and slots
         self.model.dataset_closed.connect(self.close)
@@ -41,6 +60,8 @@ class AnalysisView(QWidget):
         self.ui.spinBoxNeighborRadius.valueChanged.connect(lambda value: setattr(self.model.analysis_model.module_temperatures, 'neighbor_radius', value))
         self.model.analysis_model.module_temperatures.ignore_sun_reflections_changed.connect(self.ui.checkBoxIgnoreSunReflections.setChecked)
         self.ui.checkBoxIgnoreSunReflections.stateChanged.connect(lambda value: setattr(self.model.analysis_model.module_temperatures, 'ignore_sun_reflections', bool(value)))
+        self.model.analysis_model.module_temperatures.num_workers_changed.connect(self.spinBoxNumWorkers.setValue)
+        self.spinBoxNumWorkers.valueChanged.connect(lambda value: setattr(self.model.analysis_model.module_temperatures, 'num_workers', value))
         
         # sun filter
         self.model.analysis_model.sun_filter.threshold_temp_changed.connect(self.ui.spinBoxThresholdTemp.setValue)
@@ -51,6 +72,12 @@ class AnalysisView(QWidget):
         self.ui.spinBoxThresholdChangepoint.valueChanged.connect(lambda value: setattr(self.model.analysis_model.sun_filter, 'threshold_changepoint', value))
         self.model.analysis_model.sun_filter.segment_length_threshold_changed.connect(self.ui.spinBoxSegmentLengthThreshold.setValue)
         self.ui.spinBoxSegmentLengthThreshold.valueChanged.connect(lambda value: setattr(self.model.analysis_model.sun_filter, 'segment_length_threshold', value))
+        self.model.analysis_model.sun_filter.num_workers_changed.connect(self.spinBoxSunFilterNumWorkers.setValue)
+        self.spinBoxSunFilterNumWorkers.valueChanged.connect(lambda value: setattr(self.model.analysis_model.sun_filter, 'num_workers', value))
+        self.model.analysis_model.sun_filter.preview_changed.connect(self.labelSunFilterPreview.setText)
+        self.pushButtonSunFilterPreview.clicked.connect(self.preview_sun_filter)
+        self.model.analysis_model.sun_filter.features_changed.connect(self.enable_disable_sun_filter_preview)
+        self.controller.analysis_controller.sun_filter_features_loading_changed.connect(self.enable_disable_sun_filter_preview)
 
         # set default values
         self.controller.analysis_controller.reset()
@@ -63,11 +90,14 @@ class AnalysisView(QWidget):
         self.ui.pushButtonCompute.setEnabled(True)
         self.ui.spinBoxTruncateWidth.setEnabled(True)
         self.ui.spinBoxNeighborRadius.setEnabled(True)
+        self.spinBoxNumWorkers.setEnabled(True)
         self.ui.spinBoxThresholdTemp.setEnabled(True)
         self.ui.spinBoxThresholdLoc.setEnabled(True)
         self.ui.spinBoxThresholdChangepoint.setEnabled(True)
         self.ui.spinBoxSegmentLengthThreshold.setEnabled(True)
+        self.spinBoxSunFilterNumWorkers.setEnabled(True)
         self.enable_disable_sun_reflections()
+        self.enable_disable_sun_filter_preview()
 
     @Slot(int)
     def tabChanged(self, idx):
@@ -89,6 +119,21 @@ class AnalysisView(QWidget):
         else:
             self.ui.checkBoxIgnoreSunReflections.setEnabled(True)
 
+    @Slot()
+    def preview_sun_filter(self):
+        # extracting the features reads all patches, so it is only started on request
+        self.pushButtonSunFilterPreview.setEnabled(False)
+        self.controller.analysis_controller.load_sun_filter_features()
+
+    @Slot()
+    def enable_disable_sun_filter_preview(self):
+        # computing while the preview features load would extract the same features a second time
+        loading = self.controller.analysis_controller.thread_features is not None
+        idle = self.model.analysis_model.status is None
+        self.pushButtonSunFilterPreview.setEnabled(
+            idle and not loading and self.model.analysis_model.sun_filter.features is None)
+        self.ui.pushButtonCompute.setEnabled(idle and not loading)
+
     @Slot(object)
     def status_changed(self, status):
         if status is None:
@@ -98,11 +143,14 @@ class AnalysisView(QWidget):
             self.ui.pushButtonCompute.setEnabled(False)
             self.ui.spinBoxTruncateWidth.setEnabled(False)
             self.ui.spinBoxNeighborRadius.setEnabled(False)
+            self.spinBoxNumWorkers.setEnabled(False)
             self.ui.checkBoxIgnoreSunReflections.setEnabled(False)
             self.ui.spinBoxThresholdTemp.setEnabled(False)
             self.ui.spinBoxThresholdLoc.setEnabled(False)
             self.ui.spinBoxThresholdChangepoint.setEnabled(False)
             self.ui.spinBoxSegmentLengthThreshold.setEnabled(False)
+            self.spinBoxSunFilterNumWorkers.setEnabled(False)
+            self.pushButtonSunFilterPreview.setEnabled(False)
         elif status == "cancelled":
             self.ui.pushButtonCompute.hide()
             self.ui.pushButtonOk.show()
@@ -122,6 +170,10 @@ class AnalysisView(QWidget):
         msg.setIcon(QMessageBox.Critical)
         msg.exec()
 
+    def showEvent(self, event):
+        self.enable_disable_sun_filter_preview()
+        event.accept()
+
     def closeEvent(self, event):
         self.controller.analysis_controller.cancel()
         event.accept()
@@ -130,12 +182,26 @@ class AnalysisView(QWidget):
 
 class AnalysisController(QObject):
     name_exists = Signal()
+    sun_filter_features_loading_changed = Signal()
 
     def __init__(self, model):
         super().__init__()
         self.model = model
         self.thread = None
         self.worker = None
+        self.thread_features = None
+        self.worker_features = None
+        self.model.dataset_closed.connect(self.discard_sun_filter_features)
+
+        # re-evaluate the sun filter whenever one of its parameters changes
+        sun_filter_model = self.model.analysis_model.sun_filter
+        sun_filter_model.features_changed.connect(self.update_sun_filter_preview)
+        sun_filter_model.threshold_temp_changed.connect(self.update_sun_filter_preview)
+        sun_filter_model.threshold_loc_changed.connect(self.update_sun_filter_preview)
+        sun_filter_model.threshold_changepoint_changed.connect(self.update_sun_filter_preview)
+        sun_filter_model.segment_length_threshold_changed.connect(self.update_sun_filter_preview)
+        self.model.dataset_settings_model.gain_changed.connect(self.update_sun_filter_preview)
+        self.model.dataset_settings_model.offset_changed.connect(self.update_sun_filter_preview)
 
     @Slot()
     def reset(self):
@@ -146,11 +212,13 @@ class AnalysisController(QObject):
         self.model.analysis_model.module_temperatures.border_margin = 5
         self.model.analysis_model.module_temperatures.neighbor_radius = 7
         self.model.analysis_model.module_temperatures.ignore_sun_reflections = False
+        self.model.analysis_model.module_temperatures.num_workers = max(1, os.cpu_count() or 1)
         # sun filter
         self.model.analysis_model.sun_filter.threshold_temp = 5.0
         self.model.analysis_model.sun_filter.threshold_loc = 10.0
         self.model.analysis_model.sun_filter.threshold_changepoint = 10.0
         self.model.analysis_model.sun_filter.segment_length_threshold = 0.3
+        self.model.analysis_model.sun_filter.num_workers = max(1, os.cpu_count() or 1)
 
     @Slot()
     def compute(self):
@@ -164,6 +232,13 @@ class AnalysisController(QObject):
         if not self.model.analysis_model.active_tab_widget or self.model.analysis_model.active_tab_widget.objectName() is None:
             return
 
+        if self.thread_features is not None:
+            return  # the preview features are still loading
+
+        # the analyses pull in opencv, pandas, pyproj and scikit-learn, so they are imported on first use
+        from ..analysis.temperatures import AnalysisModuleTemperaturesWorker
+        from ..analysis.sun_filter import AnalysisSunFilterWorker
+
         self.model.analysis_model.status = "started"
         self.thread = QThread()
 
@@ -177,7 +252,9 @@ class AnalysisController(QObject):
                 self.model.analysis_model.sun_filter.threshold_temp, 
                 self.model.analysis_model.sun_filter.threshold_loc,
                 self.model.analysis_model.sun_filter.threshold_changepoint,
-                self.model.analysis_model.sun_filter.segment_length_threshold)
+                self.model.analysis_model.sun_filter.segment_length_threshold,
+                self.model.analysis_model.sun_filter.num_workers,
+                self.model.analysis_model.sun_filter.features)
                 
         elif self.model.analysis_model.active_tab_widget.objectName() == "tabModuleTemperatures":
             self.worker = AnalysisModuleTemperaturesWorker(
@@ -189,7 +266,8 @@ class AnalysisController(QObject):
                 self.model.analysis_model.module_temperatures.border_margin, 
                 self.model.analysis_model.module_temperatures.neighbor_radius,
                 self.model.analysis_model.module_temperatures.ignore_sun_reflections,
-                self.model.sun_reflections)
+                self.model.sun_reflections,
+                self.model.analysis_model.module_temperatures.num_workers)
         self.worker.moveToThread(self.thread)
         self.thread.started.connect(self.worker.run)
         self.worker.finished.connect(self.thread.quit)
@@ -212,6 +290,100 @@ class AnalysisController(QObject):
     def cancel(self):
         if self.thread is not None and self.worker is not None:
             self.worker.is_cancelled = True
+        if self.thread_features is not None and self.worker_features is not None:
+            self.worker_features.is_cancelled = True
+
+    @Slot()
+    def load_sun_filter_features(self):
+        """Loads the patch features of the sun filter in the background, after which the number of
+        flagged patches is shown for the current thresholds."""
+        if not self.model.dataset_is_open:
+            return
+        if self.model.analysis_model.sun_filter.features is not None or self.thread_features is not None:
+            return
+        from ..analysis.sun_filter import SunFilterFeaturesWorker
+
+        self.thread_features = QThread()
+        self.worker_features = SunFilterFeaturesWorker(
+            self.model.dataset_dir,
+            self.model.dataset_version,
+            self.model.analysis_model.sun_filter.num_workers)
+        self.worker_features.moveToThread(self.thread_features)
+
+        # connect signals and slots
+        self.thread_features.started.connect(self.worker_features.run)
+        self.worker_features.finished.connect(self.thread_features.quit)
+        self.worker_features.progress.connect(self.report_features_progress)
+        self.worker_features.loaded.connect(self.sun_filter_features_loaded)
+
+        def worker_finished():
+            if self.worker_features is not None:
+                self.worker_features.deleteLater()
+                self.worker_features = None
+
+        def thread_finished():
+            if self.thread_features is not None:
+                self.thread_features.deleteLater()
+                self.thread_features = None
+            # also re-enables the preview after a cancelled or failed extraction
+            self.sun_filter_features_loading_changed.emit()
+
+        self.worker_features.finished.connect(worker_finished)
+        self.thread_features.finished.connect(thread_finished)
+
+        self.thread_features.start()
+        self.sun_filter_features_loading_changed.emit()
+
+    @Slot(float, bool, str)
+    def report_features_progress(self, progress, cancelled, description):
+        if self.sender() is not self.worker_features:
+            return
+        if cancelled:
+            self.model.analysis_model.sun_filter.preview = ""
+        else:
+            self.model.analysis_model.sun_filter.preview = "{} {:.0f} %".format(description, progress*100)
+
+    @Slot(object)
+    def sun_filter_features_loaded(self, features):
+        # ignore features of a worker which has been stopped when the dataset was closed
+        if self.sender() is not self.worker_features or not self.model.dataset_is_open:
+            return
+        self.model.analysis_model.sun_filter.features = features
+
+    @Slot()
+    def update_sun_filter_preview(self):
+        sun_filter_model = self.model.analysis_model.sun_filter
+        features = sun_filter_model.features
+        if features is None:
+            return
+        if None in (sun_filter_model.threshold_temp, sun_filter_model.threshold_loc, 
+                sun_filter_model.threshold_changepoint, sun_filter_model.segment_length_threshold):
+            return
+        num_flagged = int(features.predict_flags(
+            self.model.dataset_settings_model.gain,
+            self.model.dataset_settings_model.offset,
+            sun_filter_model.threshold_temp,
+            sun_filter_model.threshold_loc,
+            sun_filter_model.threshold_changepoint,
+            sun_filter_model.segment_length_threshold).sum())
+        sun_filter_model.preview = "{} of {} patches ({:.1f} %) flagged as sun reflections".format(
+            num_flagged, features.num_patches, 100 * num_flagged / max(1, features.num_patches))
+
+    @Slot()
+    def discard_sun_filter_features(self):
+        self.stop()
+        self.model.analysis_model.sun_filter.features = None
+        self.model.analysis_model.sun_filter.preview = ""
+
+    def stop(self):
+        if self.thread_features is not None and self.worker_features is not None:
+            self.worker_features.is_cancelled = True
+            self.thread_features.quit()
+            self.thread_features.wait()
+            self.thread_features.deleteLater()
+            self.thread_features = None
+            self.worker_features = None
+            self.sun_filter_features_loading_changed.emit()
 
 
 
@@ -283,12 +455,14 @@ class AnalysisModuleTemperaturesModel(QObject):
     border_margin_changed = Signal(int)
     neighbor_radius_changed = Signal(int)
     ignore_sun_reflections_changed = Signal(bool)
+    num_workers_changed = Signal(int)
 
     def __init__(self):
         super().__init__()
         self._border_margin = None
         self._neighbor_radius = None
         self._ignore_sun_reflections = None
+        self._num_workers = None
 
     @property
     def border_margin(self):
@@ -317,6 +491,15 @@ class AnalysisModuleTemperaturesModel(QObject):
         self._ignore_sun_reflections = value
         self.ignore_sun_reflections_changed.emit(value)
 
+    @property
+    def num_workers(self):
+        return self._num_workers
+
+    @num_workers.setter
+    def num_workers(self, value):
+        self._num_workers = value
+        self.num_workers_changed.emit(value)
+
 
 
 class AnalysisSunFilterModel(QObject):
@@ -324,6 +507,9 @@ class AnalysisSunFilterModel(QObject):
     threshold_loc_changed = Signal(float)
     threshold_changepoint_changed = Signal(float)
     segment_length_threshold_changed = Signal(float)
+    num_workers_changed = Signal(int)
+    features_changed = Signal(object)
+    preview_changed = Signal(str)
 
     def __init__(self):
         super().__init__()
@@ -331,6 +517,9 @@ class AnalysisSunFilterModel(QObject):
         self._threshold_loc = None
         self._threshold_changepoint = None
         self._segment_length_threshold = None
+        self._num_workers = None
+        self._features = None
+        self._preview = ""
 
     @property
     def threshold_temp(self):
@@ -366,4 +555,31 @@ class AnalysisSunFilterModel(QObject):
     @segment_length_threshold.setter
     def segment_length_threshold(self, value):
         self._segment_length_threshold = value
-        self.segment_length_threshold_changed.emit(value)
\ No newline at end of file
+        self.segment_length_threshold_changed.emit(value)
+
+    @property
+    def num_workers(self):
+        return self._num_workers
+
+    @num_workers.setter
+    def num_workers(self, value):
+        self._num_workers = value
+        self.num_workers_changed.emit(value)
+
+    @property
+    def features(self):
+        return self._features
+
+    @features.setter
+    def features(self, value):
+        self._features = value
+        self.features_changed.emit(value)
+
+    @property
+    def preview(self):
+        return self._preview
+
+    @preview.setter
+    def preview(self, value):
+        self._preview = value
+        self.preview_changed.emit(value)
\ No newline at end of file
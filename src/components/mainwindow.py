@@ -1,10 +1,7 @@
 import os
 import glob
 import json
-import csv
 import shutil
-import pickle
-import datetime
 import pkg_resources
 import numpy as np
 
@@ -12,9 +9,15 @@ from PySide6.QtWidgets import QMainWindow, QToolBar, QDockWidget, \
     QMessageBox, QFileDialog, QLabel, QMenu
 from PySide6.QtCore import Qt, Slot, QUrl, QDir, Signal, QObject, QThread
 from PySide6.QtWebChannel import QWebChannel
-from PySide6.QtGui import QIcon, QPixmap
+from PySide6.QtGui import QIcon, QPixmap, QAction
 
 from ..utils.common import get_immediate_subdirectories
+from ..utils.patch_store import PatchStore, BuildPatchStoreWorker
+from ..utils.patch_index import PatchIndex
+from ..utils.patch_meta import PatchMeta
+from ..utils.columnar import load_geojson_table_file
+from ..utils.lru_cache import LRUCache
+from ..utils.dataset_stats import compute_dataset_stats
 
 from ..ui.ui_mainwindow import Ui_MainWindow
 from .map import MapView, ColorbarView, DataColumnSelectionView, \
@@ -54,6 +57,11 @@ class MainView(QMainWindow):
         self.ui.actionExport_String_Annotation.setIcon(QIcon.fromTheme("document-save"))
         self.ui.actionClose_String_Annotation.setIcon(QIcon.fromTheme("window-close"))
         self.ui.actionAbout.setIcon(QIcon.fromTheme("help-about"))        
+
+        # add actions which are not part of the ui file
+        self.actionBuild_Patch_Store = QAction(u"Build Patch Store", self)
+        self.actionBuild_Patch_Store.setEnabled(False)
+        self.ui.menuFile.insertAction(self.ui.actionClose_Dataset, self.actionBuild_Patch_Store)
         
         # register map view
         self.map_view = MapView(model, controller, parent=self)
@@ -134,6 +142,7 @@ class MainView(QMainWindow):
         self.ui.actionOpen_Dataset.triggered.connect(self.open_dataset)
         self.ui.actionClose_Dataset.triggered.connect(self.close_dataset)
         self.ui.actionDataset_Settings.triggered.connect(lambda: self.show_child_window("dataset_settings"))
+        self.actionBuild_Patch_Store.triggered.connect(self.controller.build_patch_store)
         self.ui.actionQuit.triggered.connect(self.close)
 
         # annotation menu
@@ -173,8 +182,14 @@ class MainView(QMainWindow):
         self.model.annotation_editor_model.current_file_name_changed.connect(self.defect_annotation_has_changes)
         self.controller.annotation_editor_controller.close_dataset.connect(self.controller.close_dataset)
         self.model.dataset_stats_changed.connect(self.update_status_bar)
+        self.model.patches_model.patches_changed.connect(self.update_status_bar)
         self.model.track_id_changed.connect(self.update_status_bar)
+        self.model.track_id_changed.connect(self.controller.prefetch_controller.prefetch)
+        self.model.dataset_opened.connect(self.controller.prefetch_controller.dataset_opened)
+        self.model.dataset_closed.connect(self.controller.prefetch_controller.dataset_closed)
         self.model.string_editor_model.string_annotation_data_changed.connect(self.update_status_bar)
+        self.controller.patch_store_progress.connect(self.patch_store_progress)
+        self.controller.dataset_load_progress.connect(self.dataset_load_progress)
         
         # load HTML document for map view
         index_file = QDir.current().filePath(pkg_resources.resource_filename("src", "index.html"))
@@ -219,13 +234,13 @@ class MainView(QMainWindow):
         self.controller.open_dataset(dir)
 
     def close_dataset(self):
-        self.controller.stop_background_threads()
         self.controller.close_dataset_request()
 
     def dataset_opened(self):
         self.ui.actionClose_Dataset.setEnabled(True)
         self.ui.actionOpen_Dataset.setEnabled(False)
         self.ui.actionDataset_Settings.setEnabled(True)
+        self.actionBuild_Patch_Store.setEnabled(self.model.ir_or_rgb == "ir")
         self.ui.actionNew_Analysis.setEnabled(True)
         self.ui.actionNew_Defect_Annotation.setEnabled(True)
         self.ui.actionLoad_Defect_Annotation.setEnabled(True)
@@ -238,6 +253,7 @@ class MainView(QMainWindow):
         self.ui.actionClose_Dataset.setEnabled(False)
         self.ui.actionOpen_Dataset.setEnabled(True)
         self.ui.actionDataset_Settings.setEnabled(False)
+        self.actionBuild_Patch_Store.setEnabled(False)
         self.ui.actionNew_Analysis.setEnabled(False)
         self.ui.actionNew_Defect_Annotation.setEnabled(False)
         self.ui.actionLoad_Defect_Annotation.setEnabled(False)
@@ -248,6 +264,22 @@ class MainView(QMainWindow):
         self.ui.actionClose_String_Annotation.setEnabled(False)
         self.ui.statusBar.showMessage("Dataset closed", 5000)
 
+    @Slot(float, bool, str)
+    def patch_store_progress(self, progress, cancelled, description):
+        if cancelled or progress >= 1:
+            self.actionBuild_Patch_Store.setEnabled(self.model.dataset_is_open)
+            self.ui.statusBar.showMessage(description, 5000)
+        else:
+            self.actionBuild_Patch_Store.setEnabled(False)
+            self.ui.statusBar.showMessage("{} {:d} %".format(description, round(progress*100)))
+
+    @Slot(float, bool, str)
+    def dataset_load_progress(self, progress, cancelled, description):
+        if cancelled or progress >= 1:
+            self.ui.statusBar.showMessage(description, 5000)
+        else:
+            self.ui.statusBar.showMessage("{} {:d} %".format(description, round(progress*100)))
+
     @Slot()
     def update_status_bar(self):
         dataset_dir = self.model.dataset_dir
@@ -271,7 +303,9 @@ class MainView(QMainWindow):
                 "Num. Modules: {}<br>".format(stats["num_modules"]) +
                 "Num. Patches: {}<br>".format(stats["num_patches"]) + 
                 "Flight duration: {}<br>".format(stats["flight_duration"]) +
-                "Trajectory length: {} m".format(int(stats["trajectory_length"]))
+                "Trajectory length: {} m<br>".format(int(stats["trajectory_length"])) +
+                "Patch cache: {}<br>".format(self.model.patch_cache.stats()) +
+                "Frame cache: {}".format(self.model.frame_cache.stats())
             )
 	
             # set module ID label
@@ -412,8 +446,12 @@ class MainView(QMainWindow):
 
     def closeEvent(self, event):
         """Ask whether unsaved changes should be saved"""
-        self.controller.stop_background_threads()
-        self.controller.mainwindow_close_requested.emit(event)        
+        self.controller.mainwindow_close_requested.emit(event)
+        # the close may have been cancelled in the annotation editor
+        if event.isAccepted():
+            self.controller.stop_background_threads()
+            self.controller.patches_controller.stop()
+            self.controller.prefetch_controller.stop()
 
 
 
@@ -428,19 +466,30 @@ class MainController(QObject):
     mainwindow_close_requested = Signal(object)
     dataset_close_requested = Signal()
     redraw_map = Signal()
+    patch_store_progress = Signal(float, bool, str)
+    dataset_load_progress = Signal(float, bool, str)
 
     def __init__(self, model):
         super().__init__()
         self.model = model
+        self.thread_load_dataset = None
+        self.worker_load_dataset = None
         self.thread_dataset_stats = None
         self.worker_dataset_stats = None
+        self.thread_patch_store = None
+        self.worker_patch_store = None
 
     def reset(self):
         self.model.dataset_dir = None
         self.model.dataset_version = None
-        self.model.data = None
+        self.model.table = None
+        self.model.polygons = None
         self.model.meta = None
         self.model.patch_meta = None
+        self.model.patch_store = None
+        self.model.patch_index = None
+        self.model.patch_cache.clear()
+        self.model.frame_cache.clear()
         self.model.sun_reflections = None
         self.model.track_ids = None
         self.model.app_mode = None
@@ -456,21 +505,57 @@ class MainController(QObject):
         self.model.dataset_dir = dataset_dir
         version_info = json.load(open(os.path.join(self.model.dataset_dir, "version.json"), "r"))
         self.model.dataset_version = version_info["dataset_version"]
-        if self.model.dataset_version == "v1":
-            self.model.patch_meta = pickle.load(open(os.path.join(
-                self.model.dataset_dir, "patches", "meta.pkl"), "rb"))
-        elif self.model.dataset_version == "v2":
-            self.model.patch_meta = pickle.load(open(os.path.join(
-                self.model.dataset_dir, "quadrilaterals", "quadrilaterals.pkl"), "rb"))
         self.determine_ir_or_rgb()
         self.load_dataset_settings()
-        self.load_sun_reflections()
         self.update_source_names()
         self.load_source("Module Layout")
         self.update_track_ids()
-        self.update_dataset_stats()
         self.model.dataset_is_open = True
         self.model.app_mode = "data_visualization"
+        # show the map first and load everything else in the background
+        self.load_dataset()
+
+    def load_dataset(self):
+        self.thread_load_dataset = QThread()
+        self.worker_load_dataset = LoadDatasetWorker(
+            self.model.dataset_dir,
+            self.model.dataset_version
+        )
+        self.worker_load_dataset.moveToThread(self.thread_load_dataset)
+
+        # connect signals and slots
+        self.thread_load_dataset.started.connect(self.worker_load_dataset.run)
+        self.worker_load_dataset.finished.connect(self.thread_load_dataset.quit)
+        self.worker_load_dataset.progress.connect(self.dataset_load_progress)
+        self.worker_load_dataset.loaded.connect(self.dataset_loaded)
+
+        def worker_finished():
+            if self.worker_load_dataset is not None:
+                self.worker_load_dataset.deleteLater()
+                self.worker_load_dataset = None
+
+        def thread_finished():
+            if self.thread_load_dataset is not None:
+                self.thread_load_dataset.deleteLater()
+                self.thread_load_dataset = None
+
+        self.worker_load_dataset.finished.connect(worker_finished)
+        self.thread_load_dataset.finished.connect(thread_finished)
+
+        self.thread_load_dataset.start()
+
+    @Slot(str, object)
+    def dataset_loaded(self, name, value):
+        # ignore results of a worker which has been stopped when the dataset was closed
+        if self.sender() is not self.worker_load_dataset or not self.model.dataset_is_open:
+            return
+        setattr(self.model, name, value)
+        if name == "patch_index":
+            self.update_dataset_stats()
+        elif name == "patch_meta":
+            # draw the quadrilateral of an already selected module
+            self.source_frame_controller_ir.update_source_frame()
+            self.source_frame_controller_rgb.update_source_frame()
 
     @Slot()
     def close_dataset_request(self):
@@ -483,6 +568,8 @@ class MainController(QObject):
 
     @Slot()
     def close_dataset(self):
+        # only called once closing is confirmed, so that a cancelled close keeps loading the dataset
+        self.stop_background_threads()
         self.reset()
 
     @Slot()
@@ -503,16 +590,65 @@ class MainController(QObject):
 
     @Slot()
     def update_track_ids(self):
-        self.model.track_ids = list(self.get_column("track_id").values())
+        self.model.track_ids = list(self.model.table.index)
 
     def load_sun_reflections(self):
         if self.model.dataset_dir is None:
             return
-        try:
-            self.model.sun_reflections = json.load(open(os.path.join(
-                self.model.dataset_dir, "analyses", "Sun Filter", "sun_filter.json"), "r"))
-        except FileNotFoundError:
-            pass
+        sun_reflections = read_sun_reflections(self.model.dataset_dir)
+        if sun_reflections is not None:
+            self.model.sun_reflections = sun_reflections
+
+    def load_patch_store(self):
+        if self.model.dataset_dir is None:
+            return
+        if self.model.dataset_version == "v1":
+            patches_dir = os.path.join(self.model.dataset_dir, "patches_final", "radiometric")
+        elif self.model.dataset_version == "v2":
+            patches_dir = os.path.join(self.model.dataset_dir, "patches", "radiometric")
+        self.model.patch_store = PatchStore.open(self.model.dataset_dir, patches_dir)
+
+    @Slot()
+    def build_patch_store(self):
+        if self.model.dataset_dir is None:
+            return
+        if self.thread_patch_store is not None:
+            return
+
+        # release the memory map of the previous store before it is replaced, this includes the
+        # views into it held by the cache, the prefetcher and the patches of the selected module
+        self.model.patch_store = None
+        self.model.patch_cache.clear()
+        self.prefetch_controller.cancel()
+        self.patches_controller.update_patches()
+
+        self.thread_patch_store = QThread()
+        self.worker_patch_store = BuildPatchStoreWorker(
+            self.model.dataset_dir,
+            self.model.dataset_version
+        )
+        self.worker_patch_store.moveToThread(self.thread_patch_store)
+
+        # connect signals and slots
+        self.thread_patch_store.started.connect(self.worker_patch_store.run)
+        self.worker_patch_store.finished.connect(self.thread_patch_store.quit)
+        self.worker_patch_store.progress.connect(self.patch_store_progress)
+
+        def worker_finished():
+            if self.worker_patch_store is not None:
+                self.worker_patch_store.deleteLater()
+                self.worker_patch_store = None
+            self.load_patch_store()
+
+        def thread_finished():
+            if self.thread_patch_store is not None:
+                self.thread_patch_store.deleteLater()
+                self.thread_patch_store = None
+
+        self.worker_patch_store.finished.connect(worker_finished)
+        self.thread_patch_store.finished.connect(thread_finished)
+
+        self.thread_patch_store.start()
 
     def determine_ir_or_rgb(self):
         if self.model.dataset_version == "v1":
@@ -574,12 +710,14 @@ class MainController(QObject):
         if selected_source is None:
             return
         if selected_source == "Module Layout":
-            self.model.data = json.load(open(os.path.join(
-                self.model.dataset_dir, "mapping", "module_geolocations_refined.geojson"), "r"))
+            self.model.table, self.model.polygons = load_geojson_table_file(
+                os.path.join(self.model.dataset_dir, "mapping", "module_geolocations_refined.geojson"),
+                os.path.join(self.model.dataset_dir, "cache", "module_layout_columns"))
             self.model.meta = None            
         else:
-            self.model.data = json.load(open(os.path.join(
-                self.model.dataset_dir, "analyses", selected_source, "results.geojson"), "r"))
+            self.model.table, self.model.polygons = load_geojson_table_file(
+                os.path.join(self.model.dataset_dir, "analyses", selected_source, "results.geojson"),
+                os.path.join(self.model.dataset_dir, "analyses", selected_source, "results_columns"))
             self.model.meta = json.load(open(os.path.join(
                 self.model.dataset_dir, "analyses", selected_source, "meta.json"), "r"))
         self.model.selected_source = selected_source
@@ -609,13 +747,13 @@ class MainController(QObject):
             min_val = -5
             max_val = 5
         else:
-            data_column = self.get_column(column)
+            data_column = self.get_column(column).dropna()
             if len(data_column) == 0:
                 min_val = -5
                 max_val = 5
             else:
-                min_val = min(data_column.values())
-                max_val = max(data_column.values())
+                min_val = data_column.min()
+                max_val = data_column.max()
         self.model.map_model.min_val = min_val
         self.model.map_model.max_val = max_val
         # set selected column
@@ -623,41 +761,34 @@ class MainController(QObject):
 
     @Slot()
     def get_column_names(self):
-        if self.model.dataset_dir is None:
+        if self.model.dataset_dir is None or self.model.table is None:
             return []
-        columns_names = set()
-        for feature in self.model.data["features"]:
-            columns_names = columns_names | set(feature["properties"].keys())
-        columns_names -= set(["track_id"])
-        return sorted(list(columns_names))
+        return sorted(self.model.table.columns)
 
     @Slot()
     def get_selected_column(self):
+        """Returns the selected column as a pandas Series indexed by track_id."""
+        import pandas as pd
         if self.model.selected_column is None:
-            return {}
+            return pd.Series(dtype=np.float64)
         columns_names = self.get_column_names()
         try:
             column = columns_names[self.model.selected_column]
         except IndexError:
-            return {}
+            return pd.Series(dtype=np.float64)
         else:
             return self.get_column(column)
 
     @Slot()
     def get_column(self, column):
-        if self.model.dataset_dir is None:
-            return {}
-        column_values = {}
-        for feature in self.model.data["features"]:
-            track_id = feature["properties"]["track_id"]
-            try:
-                val = feature["properties"][column]
-                if val is None:
-                    val = np.nan
-                column_values[track_id] = val
-            except KeyError:
-                continue
-        return column_values
+        """Returns a column of the data table as a pandas Series indexed by track_id."""
+        import pandas as pd
+        if self.model.dataset_dir is None or self.model.table is None:
+            return pd.Series(dtype=np.float64)
+        try:
+            return self.model.table[column]
+        except KeyError:
+            return pd.Series(dtype=np.float64)
 
     def update_dataset_stats(self):
         if self.model.dataset_dir is None:
@@ -666,8 +797,8 @@ class MainController(QObject):
         self.thread_dataset_stats = QThread()
         self.worker_dataset_stats = ComputeDatasetStatsWorker(
             self.model.dataset_dir,
-            self.model.dataset_version,
-            self.model.data
+            len(self.model.polygons),
+            self.model.patch_index.num_patches if self.model.patch_index is not None else 0
         )
         self.worker_dataset_stats.moveToThread(self.thread_dataset_stats)
 
@@ -695,6 +826,16 @@ class MainController(QObject):
 
     @Slot()
     def stop_background_threads(self):
+        self.patches_controller.cancel()
+        self.prefetch_controller.cancel()
+        self.analysis_controller.stop()
+        if self.thread_load_dataset is not None and self.worker_load_dataset is not None:
+            self.worker_load_dataset.is_cancelled = True
+            self.thread_load_dataset.quit()
+            self.thread_load_dataset.wait()
+            self.thread_load_dataset.deleteLater()
+            self.thread_load_dataset = None
+            self.worker_load_dataset = None
         if self.thread_dataset_stats is not None and self.worker_dataset_stats is not None:
             self.worker_dataset_stats.is_cancelled = True
             self.thread_dataset_stats.quit()
@@ -702,92 +843,103 @@ class MainController(QObject):
             self.thread_dataset_stats.deleteLater()
             self.thread_dataset_stats = None
             self.worker_dataset_stats = None
+        if self.thread_patch_store is not None and self.worker_patch_store is not None:
+            self.worker_patch_store.is_cancelled = True
+            self.thread_patch_store.quit()
+            self.thread_patch_store.wait()
+            self.thread_patch_store.deleteLater()
+            self.thread_patch_store = None
+            self.worker_patch_store = None
 
 
 
-class ComputeDatasetStatsWorker(QObject):
-    finished = Signal(object)
+def read_sun_reflections(dataset_dir):
+    """Returns the output of the sun filter or None if it has not been run."""
+    try:
+        return json.load(open(os.path.join(dataset_dir, "analyses", "Sun Filter", "sun_filter.json"), "r"))
+    except FileNotFoundError:
+        return None
+
+
+
+class LoadDatasetWorker(QObject):
+    """Loads the parts of a dataset which are not needed to show the map. Each part is emitted
+    with the name of the model attribute it belongs to as soon as it is loaded."""
+    finished = Signal()
+    progress = Signal(float, bool, str)
+    loaded = Signal(str, object)
 
-    def __init__(self, dataset_dir, dataset_version, data):
+    def __init__(self, dataset_dir, dataset_version):
         super().__init__()
         self.is_cancelled = False
         self.dataset_dir = dataset_dir
         self.dataset_version = dataset_version
-        self.data = data
-    
-    def run(self):
-        print("Started background thread")
-        # num modules
-        num_modules = 0
-        for feature in self.data["features"]:
-            if self.is_cancelled:
-                #self.finished.emit(None)
-                print("cancelled thread")
-                return
-            geometry = feature["geometry"]["type"]
-            if geometry == "Polygon":
-                num_modules += 1
 
-        print("Got num modules")
-
-        # num patches
-        num_patches = 0
+    def run(self):
         if self.dataset_version == "v1":
             patches_dir = os.path.join(self.dataset_dir, "patches_final", "radiometric")
         elif self.dataset_version == "v2":
             patches_dir = os.path.join(self.dataset_dir, "patches", "radiometric")
-        for _, _, files in os.walk(patches_dir):
-            if self.is_cancelled:
-                #self.finished.emit(None)
-                print("cancelled thread")
-                return
-            num_patches += len(files)
-
-        print("Got num patches")
-
-        # flight duration
-        timestamps = []
-        with open(os.path.join(self.dataset_dir, "splitted", "timestamps.csv"), newline='') as csvfile:
-            csvreader = csv.reader(csvfile, delimiter=',', quotechar='|')
-            for row in csvreader:
-                if self.is_cancelled:
-                    #self.finished.emit(None)
-                    print("cancelled thread")
-                    return
-                timestamps.append(datetime.datetime.fromisoformat(*row))                
-        dt = (timestamps[-1] - timestamps[0]).total_seconds()
-        hours, remainder = divmod(dt, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        flight_duration = "{:02d}:{:02d}:{:0.3f}".format(int(hours), int(minutes), seconds)
-
-        print("Got flight duration")
-
-        # trajectory length
-        pose_graph = pickle.load(open(os.path.join(self.dataset_dir, "mapping", "pose_graph.pkl"), "rb"))
-        positions = []
-        for node_id, data in pose_graph.nodes(data=True):
-            if self.is_cancelled:
-                #self.finished.emit(None)
-                print("cancelled thread")
-                return
-            pose = data["pose"][3:].reshape(3, 1)
-            positions.append(pose)
-        trajectory_length = 0
-        for i in range(1, len(positions)):
+
+        is_cancelled = lambda: self.is_cancelled
+        stages = [
+            ("patch_index", "Indexing patches...",
+                lambda: PatchIndex.open(self.dataset_dir, patches_dir, is_cancelled)),
+            ("sun_reflections", "Loading sun reflections...",
+                lambda: read_sun_reflections(self.dataset_dir)),
+            ("patch_store", "Opening patch store...",
+                lambda: PatchStore.open(self.dataset_dir, patches_dir)),
+            ("patch_meta", "Loading patch metadata...",
+                lambda: PatchMeta.open(self.dataset_dir, self.dataset_version, is_cancelled)),
+        ]
+        failed = []
+        for i, (name, description, load) in enumerate(stages):
+            progress = i / len(stages)
             if self.is_cancelled:
-                #self.finished.emit(None)
-                print("cancelled thread")
+                self.progress.emit(progress, True, "Cancelled")
+                self.finished.emit()
                 return
-            trajectory_length += np.linalg.norm(positions[i] - positions[i-1])
+            self.progress.emit(progress, False, description)
+            # a failing stage leaves its part of the model empty, the other stages are still loaded
+            try:
+                value = load()
+            except Exception as e:
+                print("Could not load {}: {}".format(name, e))
+                failed.append(name)
+                value = None
+            self.loaded.emit(name, value)
+
+        if self.is_cancelled:
+            self.progress.emit(1, True, "Cancelled")
+        elif len(failed) > 0:
+            self.progress.emit(1, True, "Dataset loaded, could not load {}".format(", ".join(failed)))
+        else:
+            self.progress.emit(1, False, "Dataset loaded")
+        self.finished.emit()
+
 
-        print("Got trajectory length")
 
+class ComputeDatasetStatsWorker(QObject):
+    finished = Signal(object)
+
+    def __init__(self, dataset_dir, num_modules, num_patches):
+        super().__init__()
+        self.is_cancelled = False
+        self.dataset_dir = dataset_dir
+        self.num_modules = num_modules
+        self.num_patches = num_patches
+    
+    def run(self):
+        print("Started background thread")
+        stats = compute_dataset_stats(self.dataset_dir, lambda: self.is_cancelled)
+        if stats is None:
+            print("cancelled thread")
+            return
         print("Finished computing dataset stats")    
         stats = {
-            "num_modules": num_modules,
-            "num_patches": num_patches,
-            "flight_duration": flight_duration,
-            "trajectory_length": trajectory_length,
+            "num_modules": self.num_modules,
+            "num_patches": self.num_patches,
+            **stats
         }
         self.finished.emit(stats)
 
@@ -805,14 +957,20 @@ class MainModel(QObject):
     dataset_stats_changed = Signal()
     app_mode_changed = Signal(str)
 
-    def __init__(self):
+    def __init__(self, patch_cache_bytes=128*1024**2, frame_cache_bytes=512*1024**2):
         super().__init__()
         self.dataset_dir = None
         self.dataset_version = None
-        self.data = None
+        self.table = None  # pandas DataFrame of the selected source indexed by track_id
+        self.polygons = None  # polygon coordinates of each track_id
         self._meta = None
         self._sun_reflections = None
         self.patch_meta = None
+        self.patch_store = None
+        self.patch_index = None
+        # patches of recently viewed and prefetched modules and decoded source frames
+        self.patch_cache = LRUCache(maxsize=64, max_bytes=patch_cache_bytes)
+        self.frame_cache = LRUCache(max_bytes=frame_cache_bytes)
         self.track_ids = None
         self._app_mode = None # "None", "data_visualization", "defect_annotation", "string_annotation"
         self._source_names = None
@@ -1,22 +1,19 @@
 import json
-import matplotlib
-matplotlib.use('QtAgg')
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-from matplotlib.figure import Figure
-import matplotlib.pyplot as plt
+import numpy as np
 
 from PySide6.QtWidgets import QWidget, QLabel, QHBoxLayout, QComboBox, \
     QMenu, QPushButton
-from PySide6.QtCore import Slot, Signal, QObject
-from PySide6.QtGui import QAction
+from PySide6.QtCore import Slot, Signal, QObject, QRect
+from PySide6.QtGui import QAction, QImage, QPainter, QPalette
 
-from ..utils.colormap import get_colors
+from ..utils.colormap import get_colors, get_colormap_lut_packed
 from ..ui.ui_toolbar_data_range import Ui_DataRange
 from ..ui.ui_toolbar_colormap_selection import Ui_ColormapSelection
 
 
 class MapView(QObject):
-    dataset_changed = Signal(bool)  # signals for notification of Javascript
+    geometry_changed = Signal(bool)  # signals for notification of Javascript
+    colors_changed = Signal()
     dataset_closed = Signal()
     annotation_data_changed = Signal()
     track_id_changed = Signal(str, str)
@@ -30,13 +27,13 @@ class MapView(QObject):
         # connect signals and slots
         self.controller.source_deleted.connect(self.dataset_closed)
         self.model.dataset_closed.connect(self.dataset_closed)
-        self.model.dataset_opened.connect(lambda: self.dataset_changed.emit(True))
-        self.model.selected_source_changed.connect(lambda: self.dataset_changed.emit(True))
-        self.model.selected_column_changed.connect(lambda: self.dataset_changed.emit(False))
-        self.model.map_model.colormap_changed.connect(lambda: self.dataset_changed.emit(False))
+        self.model.dataset_opened.connect(lambda: self.geometry_changed.emit(True))
+        self.model.selected_source_changed.connect(lambda: self.geometry_changed.emit(True))
+        self.model.selected_column_changed.connect(self.colors_changed)
+        self.model.map_model.colormap_changed.connect(self.colors_changed)
 
         # signal for explicitly redrawing the map
-        self.controller.redraw_map.connect(lambda: self.dataset_changed.emit(False))
+        self.controller.redraw_map.connect(self.colors_changed)
 
         # defect annotation editor
         self.model.annotation_editor_model.annotation_data_changed.connect(self.annotation_data_changed)
@@ -45,7 +42,12 @@ class MapView(QObject):
         # show/hide layers
         self.model.map_model.show_strings_changed.connect(self.show_strings_changed)
 
-        self.current_map_data = None
+        self.dataset_closed.connect(self.reset)
+        self.reset()
+
+    def reset(self):
+        self.current_track_ids = []
+        self.current_colors = None
 
     @Slot(str)
     def printObj(self, obj):
@@ -54,33 +56,45 @@ class MapView(QObject):
         print(py_obj)
 
     @Slot(result=str)
-    def get_data(self):
+    def get_geometry(self):
+        """Returns the polygons of all modules. Called by Javascript once per dataset and source."""
         self.model.track_id = None
-        data = []
-        colors = {}
+        self.current_track_ids = []
+        self.current_colors = None
+        polygons = []
+        if self.model.dataset_is_open:
+            self.current_track_ids = list(self.model.polygons.keys())
+            polygons = list(self.model.polygons.values())
+        print("Sending geometry of {} modules".format(len(polygons)))
+        return json.dumps({
+            "track_ids": self.current_track_ids,
+            "polygons": polygons
+        })
+
+    @Slot(result=str)
+    def get_colors(self):
+        """Returns the colors of all modules in the order of the track_ids sent in `get_geometry`."""
+        default_color = "#ff7800"
+        colors = np.full(len(self.current_track_ids), default_color)
         if self.model.dataset_is_open:
-            data = self.model.data
             data_column = self.controller.get_selected_column()
             if len(data_column) > 0:
-                colors = get_colors(
-                    data_column, 
+                # align column with the modules on the map
+                idxs = data_column.index.get_indexer(self.current_track_ids)
+                has_value = idxs >= 0
+                colors[has_value] = get_colors(
+                    data_column.values[idxs[has_value]],
                     cmap=self.model.map_model.colormap, 
                     vmin=self.model.map_model.min_val, 
                     vmax=self.model.map_model.max_val
                 )
-            else:
-                default_color = "#ff7800"
-                colors = {track_id: default_color for track_id in self.model.track_ids}
-        map_data = {
-            "data": data,
-            "colors": colors
-        }
-        if map_data != self.current_map_data:
-            print("Data changed, redrawing")
-            self.current_map_data = map_data
-            return json.dumps(map_data)
+        colors = colors.tolist()
+        if colors != self.current_colors:
+            print("Colors changed, restyling")
+            self.current_colors = colors
+            return json.dumps(colors)
         else:
-            print("Data has not changed, not redrawing")
+            print("Colors have not changed, not restyling")
             return json.dumps(None)
 
     @Slot(str)
@@ -100,12 +114,71 @@ class MapView(QObject):
         
         
 
-class MplCanvas(FigureCanvasQTAgg):
-    def __init__(self, dpi=96):
-        self.fig = Figure(dpi=dpi)
-        self.axes = self.fig.add_subplot(111)
-        self.fig.subplots_adjust(left=0.02, right=0.98, top=0.9, bottom=0.7)
-        super(MplCanvas, self).__init__(self.fig)
+def get_colorbar_ticks(vmin, vmax, max_ticks=8):
+    """Returns evenly spaced tick values between vmin and vmax with a step of 1, 2, 2.5 or 5
+    times a power of ten and at most `max_ticks` ticks, and the number of decimals needed to
+    format them."""
+    if vmax <= vmin or max_ticks < 1:
+        return [], 0
+    for step in 10**np.floor(np.log10((vmax - vmin) / max_ticks)) * np.array([1, 2, 2.5, 5, 10]):
+        first = np.ceil(vmin / step - 1e-9)
+        last = np.floor(vmax / step + 1e-9)
+        if last - first + 1 <= max_ticks:
+            break
+    ticks = (np.arange(first, last + 1) * step + 0.0).tolist()  # + 0.0 turns -0.0 into 0.0
+    decimals = max(0, int(-np.floor(np.log10(step) + 1e-9)))
+    if not np.isclose(round(step, decimals), step):
+        decimals += 1  # e.g. a step of 0.25
+    return ticks, decimals
+
+
+
+class ColorbarWidget(QWidget):
+    """Horizontal colorbar with tick labels and a label below, drawn with QPainter from a
+    colormap LUT (see `get_colormap_lut_packed`)."""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.image = None
+        self.vmin = None
+        self.vmax = None
+        self.label = ""
+
+    def set_colorbar(self, lut, vmin, vmax, label=""):
+        colors = (lut | 0xFF000000).astype(np.uint32)
+        self.image = QImage(colors.data, len(colors), 1, 4 * len(colors), QImage.Format_ARGB32).copy()
+        self.vmin = vmin
+        self.vmax = vmax
+        self.label = label
+        self.update()
+
+    def paintEvent(self, event):
+        if self.image is None:
+            return
+        painter = QPainter(self)
+        metrics = painter.fontMetrics()
+        margin = max(2, round(0.02 * self.width()))
+        bar = QRect(margin, 5, self.width() - 2 * margin, 10)
+        painter.drawImage(bar, self.image)
+        painter.setPen(self.palette().color(QPalette.WindowText))
+        painter.drawRect(bar.adjusted(0, 0, -1, -1))
+
+        if self.vmin is not None and self.vmax is not None:
+            label_width = metrics.horizontalAdvance("-{:.2f}".format(max(abs(self.vmin), abs(self.vmax))))
+            max_ticks = max(2, bar.width() // (label_width + 20))
+            ticks, decimals = get_colorbar_ticks(self.vmin, self.vmax, max_ticks)
+            for tick in ticks:
+                x = bar.left() + round((tick - self.vmin) / (self.vmax - self.vmin) * (bar.width() - 1))
+                painter.drawLine(x, bar.bottom() + 1, x, bar.bottom() + 3)
+                text = "{:.{}f}".format(tick, decimals)
+                text_width = metrics.horizontalAdvance(text)
+                text_x = min(max(0, x - text_width // 2), self.width() - text_width)
+                painter.drawText(text_x, bar.bottom() + 4 + metrics.ascent(), text)
+
+        if self.label:
+            painter.drawText(
+                (self.width() - metrics.horizontalAdvance(self.label)) // 2,
+                self.height() - metrics.descent(), self.label)
+        painter.end()
 
 
 
@@ -114,7 +187,7 @@ class ColorbarView(QWidget):
         super().__init__()
         self.model = model
         self.controller = controller
-        self.widget = MplCanvas()
+        self.widget = ColorbarWidget()
         self.widget.setFixedHeight(50)
         self.widget.hide()
 
@@ -139,23 +212,15 @@ class ColorbarView(QWidget):
         
         self.widget.show()
 
-        cmap = matplotlib.cm.get_cmap(self.model.map_model.colormap, 256)
-        norm = matplotlib.colors.Normalize(
-            vmin=self.model.map_model.min_val, 
-            vmax=self.model.map_model.max_val)
-
-        cbar = self.widget.fig.colorbar(
-            matplotlib.cm.ScalarMappable(norm=norm, cmap=cmap),
-            cax=self.widget.axes,
-            orientation='horizontal')
-
         label = ""
         if self.model.meta["type"] == "module_temperatures":
             label = "Temperatures / °C"
-        
-        cbar.set_label(label, labelpad=0, fontsize=10)
-        cbar.ax.tick_params(labelsize=10, length=2, width=1)
-        self.widget.draw()
+
+        self.widget.set_colorbar(
+            get_colormap_lut_packed(self.model.map_model.colormap),
+            self.model.map_model.min_val,
+            self.model.map_model.max_val,
+            label)
 
 
 
@@ -222,7 +287,6 @@ class ColormapSelectionView(QWidget):
         self.ui = Ui_ColormapSelection()
         self.ui.setupUi(self)
         self.disable()        
-        self.ui.colormapComboBox.addItems(self.model.map_model.colormaps)
         # connect signals and slots
         self.ui.colormapComboBox.currentIndexChanged.connect(lambda value: setattr(self.model.map_model, 'colormap', value))
         self.model.map_model.colormap_changed.connect(self.ui.colormapComboBox.setCurrentIndex)
@@ -237,6 +301,9 @@ class ColormapSelectionView(QWidget):
         elif self.model.selected_source == "Module Layout":
             self.disable()
         else:
+            # the list of colormaps is loaded from matplotlib when it is first needed
+            if self.ui.colormapComboBox.count() == 0:
+                self.ui.colormapComboBox.addItems(self.model.map_model.colormaps)
             self.ui.colormapComboBox.setEnabled(True)
 
     def disable(self):
@@ -353,8 +420,7 @@ class MapModel(QObject):
         self._min_val = None
         self._max_val = None
         self._colormap = None
-        colormaps = sorted(plt.colormaps(), key=lambda x: str.lower(x))
-        self._colormaps = [c for c in colormaps if c[-2:] != "_r"]
+        self._colormaps = None  # loaded on first use
         self._show_strings = None
     
     @property
@@ -377,16 +443,21 @@ class MapModel(QObject):
 
     @property
     def colormap(self):
-        return self._colormap
+        if self._colormap is None:
+            return None
+        return self.colormaps[self._colormap]
 
     @colormap.setter
     def colormap(self, value):
-        cmap = self._colormaps[value]
-        self._colormap = cmap
+        self._colormap = value
         self.colormap_changed.emit(value)
 
     @property
     def colormaps(self):
+        if self._colormaps is None:
+            import matplotlib.pyplot as plt
+            colormaps = sorted(plt.colormaps(), key=lambda x: str.lower(x))
+            self._colormaps = [c for c in colormaps if c[-2:] != "_r"]
         return self._colormaps
 
     @property
@@ -1,19 +1,133 @@
 import os
-import glob
 import pkg_resources
-import cv2
 
-from PySide6.QtWidgets import QWidget, QLabel, QGridLayout, \
-    QScrollArea
-from PySide6.QtCore import Qt, Slot, Signal, QObject, QPoint
-from PySide6.QtGui import QPixmap, QImage, QPainter
+from PySide6.QtWidgets import QWidget, QGridLayout, QListView, \
+    QAbstractItemView, QStyledItemDelegate
+from PySide6.QtCore import Qt, Slot, Signal, QObject, QPoint, QSize, QThread, \
+    QAbstractListModel, QModelIndex
+from PySide6.QtGui import QPixmap, QImage, QPainter, QPixmapCache
 
-from ..utils.common import to_celsius, normalize
-from ..utils.flow_layout import FlowLayout
+from ..utils.common import to_celsius
+from ..utils.colormap import get_ir_lut, apply_ir_lut
+from ..utils.patch_store import read_patch, list_patch_files
 from ..analysis.temperatures import truncate_patch
 
 
 
+class PatchListModel(QAbstractListModel):
+    """List model of the patches of the current module. Each row holds the RGB image and statistics of a patch."""
+    ImageRole = Qt.UserRole + 1
+    StatsRole = Qt.UserRole + 2
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.model = model
+        self.images = []
+        self.statistics = []
+        self.generation = 0  # changes whenever the images change to invalidate cached pixmaps
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.images)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.images):
+            return None
+        if role == self.ImageRole:
+            return self.images[index.row()]
+        elif role == self.StatsRole:
+            return self.statistics[index.row()]
+        elif role == Qt.ToolTipRole:
+            return self.tooltip(self.statistics[index.row()])
+        return None
+
+    def tooltip(self, stats):
+        if self.model.ir_or_rgb == "ir":
+            tooltip = ("Mean Temp: {:0.2f} °C<br>".format(stats["mean_temp"]) + 
+                "Max Temp: {:0.2f} °C<br>".format(stats["max_temp"]) +
+                "Size: {} x {} px<br>".format(*stats["shape"]))
+            if "sun_reflection" in stats:
+                if stats["sun_reflection"]:
+                    tooltip += "Sun Reflection: yes"
+                else:
+                    tooltip += "Sun Reflection: no"
+            else:
+                tooltip += "Sun Reflection: n.A."
+        elif self.model.ir_or_rgb == "rgb":
+            tooltip = ("Size: {} x {} px".format(*stats["shape"]))
+        else:
+            raise RuntimeError("Unknown whether this is an IR or RGB dataset.")
+        return tooltip
+
+    @Slot(object)
+    def set_patches(self, patches):
+        self.beginResetModel()
+        self.generation += 1
+        if patches is None:
+            self.images = []
+            self.statistics = []
+        else:
+            self.images, self.statistics = list(patches[0]), list(patches[1])
+        self.endResetModel()
+
+    @Slot(object, object)
+    def add_patch(self, image, stats):
+        row = len(self.images)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.images.append(image)
+        self.statistics.append(stats)
+        self.endInsertRows()
+
+
+
+class PatchDelegate(QStyledItemDelegate):
+    """Draws the thumbnails of patches. Thumbnails are only rasterized when they become visible
+    and are reused via QPixmapCache."""
+    display_width = 100
+    display_height = 160
+    padding = 3
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.sun_icon = QPixmap(pkg_resources.resource_filename("src.resources", "sun_icon.png")).scaled(16, 16)
+        self.no_sun_icon = QPixmap(pkg_resources.resource_filename("src.resources", "no_sun_icon.png")).scaled(16, 16)
+
+    def sizeHint(self, option, index):
+        return QSize(self.display_width, self.display_height)
+
+    def thumbnail(self, index):
+        list_model = index.model()
+        key = "patch_{}_{}_{}".format(id(list_model), list_model.generation, index.row())
+        pixmap = QPixmapCache.find(key)
+        if pixmap is not None and not pixmap.isNull():
+            return pixmap
+
+        # convert to QPixmap
+        image = index.data(PatchListModel.ImageRole)
+        height, width, _ = image.shape
+        bytesPerLine = 3 * width
+        pixmap = QPixmap(QImage(
+            image.data, width, height, bytesPerLine, QImage.Format_RGB888))
+        pixmap = pixmap.scaled(self.display_width, self.display_height)
+
+        # draw sun icon to indicate whether patch has sun reflection
+        stats = index.data(PatchListModel.StatsRole)
+        if "sun_reflection" in stats:
+            icon = self.sun_icon if stats["sun_reflection"] else self.no_sun_icon
+            painter = QPainter(pixmap)
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.drawPixmap(QPoint(self.padding, self.padding), icon)
+            painter.end()
+
+        QPixmapCache.insert(key, pixmap)
+        return pixmap
+
+    def paint(self, painter, option, index):
+        painter.drawPixmap(option.rect.topLeft(), self.thumbnail(index))
+
+
+
 class PatchesView(QWidget):
     def __init__(self, model, controller, parent=None):
         super().__init__(parent)
@@ -23,11 +137,12 @@ class PatchesView(QWidget):
         self.build_ui()
         # connect signals and slots
         self.model.track_id_changed.connect(lambda _: self.controller.patches_controller.update_patches())
-        self.model.patches_model.patches_changed.connect(self.update_patches_labels)
-        self.model.source_frame_model_ir.min_temp_changed.connect(lambda _: self.controller.patches_controller.update_patches())
-        self.model.source_frame_model_ir.max_temp_changed.connect(lambda _: self.controller.patches_controller.update_patches())
-        self.model.source_frame_model_ir.colormap_changed.connect(lambda _: self.controller.patches_controller.update_patches())
-        self.controller.source_deleted.connect(lambda: setattr(self.model.patches_model, 'patches', None))
+        self.model.patches_model.patches_changed.connect(self.list_model.set_patches)
+        self.model.patches_model.patch_added.connect(self.list_model.add_patch)
+        self.model.source_frame_model_ir.min_temp_changed.connect(lambda _: self.controller.patches_controller.render_patches())
+        self.model.source_frame_model_ir.max_temp_changed.connect(lambda _: self.controller.patches_controller.render_patches())
+        self.model.source_frame_model_ir.colormap_changed.connect(lambda _: self.controller.patches_controller.render_patches())
+        self.controller.source_deleted.connect(self.controller.patches_controller.clear_patches)
         self.model.sun_reflections_changed.connect(self.controller.patches_controller.update_patches)
 
         # set default values
@@ -35,152 +150,233 @@ class PatchesView(QWidget):
 
     def build_ui(self):
         self.grid_layout = QGridLayout(self)
-        self.scrollArea = QScrollArea(self)
-        self.scrollArea.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
-        self.scrollArea.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        self.scrollArea.setWidgetResizable(True)
-        self.inner = QWidget(self.scrollArea)
-        self.inner.setLayout(FlowLayout())
-        self.scrollArea.setWidget(self.inner)
-        self.grid_layout.addWidget(self.scrollArea, 0, 0, 1, 1)        
+        self.list_model = PatchListModel(self.model, self)
+        self.list_view = QListView(self)
+        self.list_view.setViewMode(QListView.IconMode)
+        self.list_view.setResizeMode(QListView.Adjust)
+        self.list_view.setMovement(QListView.Static)
+        self.list_view.setWrapping(True)
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setSpacing(PatchDelegate.padding)
+        self.list_view.setSelectionMode(QAbstractItemView.NoSelection)
+        self.list_view.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
+        self.list_view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.list_view.setItemDelegate(PatchDelegate(self.list_view))
+        self.list_view.setModel(self.list_model)
+        self.grid_layout.addWidget(self.list_view, 0, 0, 1, 1)
 
-    def clear_patches(self):
-        while self.inner.layout().count():
-            child = self.inner.layout().takeAt(0)
-            if child.widget():
-                child.widget().deleteLater()
-
-    def overlay_pixmaps(self, p1, p2, padding=3):
-        s = p1.size().expandedTo(p2.size())
-        result =  QPixmap(s)
-        result.fill(Qt.transparent)
-        painter = QPainter(result)
-        painter.setRenderHint(QPainter.Antialiasing)
-        painter.drawPixmap(QPoint(), p1)
-        painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
-        painter.drawPixmap(QPoint(padding, padding), p2)
-        painter.end()
-        return result
 
-    @Slot(object)
-    def update_patches_labels(self, patches):
-        self.clear_patches()
-        if patches is None:
-            self.clear_patches()
-            return
-        images, statistics = patches
-        for patch, stats in zip(images, statistics):
-            # convert to QPixmap
-            height, width, _ = patch.shape
-            bytesPerLine = 3 * width
-            patch = QPixmap(QImage(
-                patch.data, width, height, bytesPerLine, QImage.Format_RGB888))
-            display_width = 100
-            display_height = 160
-            label = QLabel(self)
-            patch = patch.scaled(display_width, display_height)
-
-            if self.model.ir_or_rgb == "ir":
-                tooltip = ("Mean Temp: {:0.2f} °C<br>".format(stats["mean_temp"]) + 
-                    "Max Temp: {:0.2f} °C<br>".format(stats["max_temp"]) +
-                    "Size: {} x {} px<br>".format(*stats["shape"]))
-
-                if "sun_reflection" in stats:
-                    if stats["sun_reflection"]:
-                        tooltip += "Sun Reflection: yes"
-                        has_sun_reflection_icon = QPixmap(pkg_resources.resource_filename("src.resources", "sun_icon.png"))
-                    else:
-                        tooltip += "Sun Reflection: no"
-                        has_sun_reflection_icon = QPixmap(pkg_resources.resource_filename("src.resources", "no_sun_icon.png"))
-
-                    # draw sun icon to indicate whether patch has sun reflection
-                    has_sun_reflection_icon = has_sun_reflection_icon.scaled(16, 16)
-                    patch = self.overlay_pixmaps(patch, has_sun_reflection_icon)
-                else:
-                    tooltip += "Sun Reflection: n.A."
-                    
-            elif self.model.ir_or_rgb == "rgb":
-                tooltip = ("Size: {} x {} px".format(*stats["shape"]))
-            else:
-                raise RuntimeError("Unknown whether this is an IR or RGB dataset.")
 
-            label.setPixmap(patch)
-            label.setToolTip(tooltip)
-            self.inner.layout().addWidget(label)
+def read_patch_image(image_file, request):
+    """Reads a patch. Returns the raw uint16 values for IR datasets (see `render_patch`) and the
+    RGB image for RGB datasets."""
+    if request["ir_or_rgb"] == "ir":
+        image = read_patch(image_file, request["patch_store"])
+    elif request["ir_or_rgb"] == "rgb":
+        import cv2
+        image = cv2.imread(image_file, cv2.IMREAD_COLOR)
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    else:
+        raise RuntimeError("Unknown whether this is an IR or RGB dataset.")
+    return image
+
+
+def get_patch_stats(image_file, image, request):
+    """Computes the statistics of a patch read with `read_patch_image`."""
+    if request["ir_or_rgb"] == "ir":
+        image_celsius = to_celsius(image, request["gain"], request["offset"])
+        image_cropped = truncate_patch(image_celsius, margin=0.05)
+        stats = {
+            "max_temp": image_cropped.max(),
+            "mean_temp": image_cropped.mean(),
+            "shape": image.shape[:2]
+        }
+
+        if request["sun_reflections"] is not None:
+            patch_name = os.path.splitext(os.path.basename(image_file))[0]
+            stats["sun_reflection"] = (patch_name in request["sun_reflections"])
+
+    elif request["ir_or_rgb"] == "rgb":
+        stats = {
+            "shape": image.shape[:2]
+        }
+
+    else:
+        raise RuntimeError("Unknown whether this is an IR or RGB dataset.")
+
+    return stats
+
+
+def read_module_patches(request, patch_cache=None):
+    """Yields the file name and image of each patch of the module in `request`. Once all patches
+    of a module are read, they are kept in `patch_cache` (see `LRUCache`) if provided."""
+    key = (request["patches_dir"], request["track_id"], request["ir_or_rgb"])
+    patches = None
+    if patch_cache is not None:
+        patches = patch_cache.get(key)
+    if patches is not None:
+        yield from patches
+        return
+
+    patches = []
+    image_files = list_patch_files(request["patches_dir"], request["track_id"], request["patch_store"], request["patch_index"])
+    for image_file in image_files:
+        image = read_patch_image(image_file, request)
+        patches.append((image_file, image))
+        yield image_file, image
+
+    if patch_cache is not None:
+        patch_cache.put(key, patches)
+
+
+def render_patch(image, lut=None):
+    """Converts a patch returned by `read_patch_image` into an RGB image for display using the lookup table
+    `lut` (see `get_ir_lut`). RGB patches are returned unchanged."""
+    if lut is None:
+        return image
+    return apply_ir_lut(image, lut)
+
+
+
+class PatchLoaderWorker(QObject):
+    """Loads the patches of a module in a background thread and emits them one by one.
+    Only the most recent request is processed, older requests are dropped."""
+    patch_loaded = Signal(int, object, object)
+    loading_finished = Signal(int)
+
+    def __init__(self):
+        super().__init__()
+        self.latest_request_id = 0  # set from the GUI thread
+
+    def is_stale(self, request_id):
+        return request_id != self.latest_request_id
+
+    @Slot(int, object)
+    def load(self, request_id, request):
+        if self.is_stale(request_id):
+            return
+        for image_file, image in read_module_patches(request, request["patch_cache"]):
+            if self.is_stale(request_id):
+                return
+            self.patch_loaded.emit(request_id, image, get_patch_stats(image_file, image, request))
+        self.loading_finished.emit(request_id)
 
 
 
 class PatchesController(QObject):
+    load_requested = Signal(int, object)
+
     def __init__(self, model):
         super().__init__()
         self.model = model
+        self.request_id = 0
+        # loaded patches of the current module for re-rendering
+        self.raw_patches = []
+        self.statistics = []
+        self.thread = QThread()
+        self.worker = PatchLoaderWorker()
+        self.worker.moveToThread(self.thread)
+        self.load_requested.connect(self.worker.load)
+        self.worker.patch_loaded.connect(self.patch_loaded)
+        self.worker.loading_finished.connect(self.loading_finished)
+        self.thread.start()
+
+    def new_request(self):
+        # invalidates all pending requests
+        self.request_id += 1
+        self.worker.latest_request_id = self.request_id
+        return self.request_id
 
     @Slot()
     def update_patches(self):
-        if not self.model.dataset_is_open:
+        request_id = self.new_request()
+        self.raw_patches = []
+        self.statistics = []
+        if not self.model.dataset_is_open or self.model.track_id is None:
             self.model.patches_model.patches = None
             return
 
-        track_id = self.model.track_id
-        if track_id is None:
-            self.model.patches_model.patches = None
-            return
+        request = self.get_request(self.model.track_id)
+        self.model.patches_model.patches = ([], [])
+        self.load_requested.emit(request_id, request)
 
-        # load patches from directory
+    def get_request(self, track_id):
+        """Returns everything the loader needs to read the patches of a module."""
         if self.model.dataset_version == "v1":
             patches_dir = os.path.join(self.model.dataset_dir, "patches_final", "radiometric")
         elif self.model.dataset_version == "v2":
             patches_dir = os.path.join(self.model.dataset_dir, "patches", "radiometric")
 
-        image_files = sorted(glob.glob(os.path.join(patches_dir, track_id, "*")))
-        
-        images = []
-        statistics = []
-        for image_file in image_files:
-            if self.model.ir_or_rgb == "ir":
-                image = cv2.imread(image_file, cv2.IMREAD_ANYDEPTH)
-                image = to_celsius(image, self.model.dataset_settings_model.gain, self.model.dataset_settings_model.offset)
-                image_cropped = truncate_patch(image, margin=0.05)
-                stats = {
-                    "max_temp": image_cropped.max(),
-                    "mean_temp": image_cropped.mean(),
-                    "shape": image.shape[:2]
-                }
-
-                if self.model.sun_reflections is not None:
-                    patch_name = os.path.splitext(os.path.basename(image_file))[0]
-                    stats["sun_reflection"] = (patch_name in self.model.sun_reflections[track_id])
-
-                image = normalize(image, vmin=self.model.source_frame_model_ir.min_temp, vmax=self.model.source_frame_model_ir.max_temp)
-                image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
-                if self.model.source_frame_model_ir.colormap > 0:
-                    colormaps = {
-                        1: cv2.COLORMAP_PLASMA,
-                        2: cv2.COLORMAP_JET
-                    }
-                    colormap = colormaps[self.model.source_frame_model_ir.colormap]
-                    image = cv2.applyColorMap(image, colormap)
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-            elif self.model.ir_or_rgb == "rgb":
-                image = cv2.imread(image_file, cv2.IMREAD_COLOR)
-                stats = {
-                    "shape": image.shape[:2]
-                }
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        sun_reflections = None
+        if self.model.sun_reflections is not None:
+            sun_reflections = set(self.model.sun_reflections[track_id])
 
-            else:
-                raise RuntimeError("Unknown whether this is an IR or RGB dataset.")
+        return {
+            "track_id": track_id,
+            "patches_dir": patches_dir,
+            "patch_store": self.model.patch_store,
+            "patch_index": self.model.patch_index,
+            "patch_cache": self.model.patch_cache,
+            "ir_or_rgb": self.model.ir_or_rgb,
+            "gain": self.model.dataset_settings_model.gain,
+            "offset": self.model.dataset_settings_model.offset,
+            "sun_reflections": sun_reflections
+        }
+
+    def get_lut(self):
+        if self.model.ir_or_rgb != "ir":
+            return None
+        return get_ir_lut(
+            self.model.dataset_settings_model.gain,
+            self.model.dataset_settings_model.offset,
+            self.model.source_frame_model_ir.min_temp,
+            self.model.source_frame_model_ir.max_temp,
+            self.model.source_frame_model_ir.colormap)
+
+    @Slot()
+    def render_patches(self):
+        """Re-renders the loaded patches, e.g. after the display range or colormap changed."""
+        if self.model.patches_model.patches is None:
+            return
+        lut = self.get_lut()
+        images = [render_patch(raw_patch, lut) for raw_patch in self.raw_patches]
+        self.model.patches_model.patches = (images, list(self.statistics))
+
+    @Slot(int, object, object)
+    def patch_loaded(self, request_id, raw_patch, stats):
+        if request_id != self.request_id:
+            return
+        self.raw_patches.append(raw_patch)
+        self.statistics.append(stats)
+        self.model.patches_model.add_patch(render_patch(raw_patch, self.get_lut()), stats)
 
-            images.append(image)
-            statistics.append(stats)
-        
-        self.model.patches_model.patches = (images, statistics)
+    @Slot(int)
+    def loading_finished(self, request_id):
+        if request_id != self.request_id:
+            return
+        print("Loaded {} patches".format(len(self.model.patches_model.patches[0])))
+
+    @Slot()
+    def cancel(self):
+        self.new_request()
+
+    @Slot()
+    def clear_patches(self):
+        self.cancel()
+        self.raw_patches = []
+        self.statistics = []
+        self.model.patches_model.patches = None
+
+    def stop(self):
+        self.cancel()
+        self.thread.quit()
+        self.thread.wait()
 
 
 
 class PatchesModel(QObject):
     patches_changed = Signal(object)
+    patch_added = Signal(object, object)
 
     def __init__(self):
         super().__init__()
@@ -194,3 +390,9 @@ class PatchesModel(QObject):
     def patches(self, value):
         self._patches = value
         self.patches_changed.emit(value)
+
+    def add_patch(self, image, stats):
+        images, statistics = self._patches
+        images.append(image)
+        statistics.append(stats)
+        self.patch_added.emit(image, stats)
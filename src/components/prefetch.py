@@ -0,0 +1,200 @@
+"""Prefetching of the modules the user is likely to click next.
+
+Modules are usually inspected one after another along a row or string. After
+each click, the neighbours of the selected module are predicted from the
+string annotation (if any), the direction of the last step on the map and
+the nearest module centers. Their patches and source frames are then read in
+a background thread into the patch and frame caches of the model, so that
+the patch and source frame views can show them without touching the disk.
+"""
+
+import numpy as np
+
+from PySide6.QtCore import Slot, Signal, QObject, QThread
+
+from .patches import read_module_patches
+from ..utils.source_frames import get_source_frame_idx, read_source_frame
+
+
+def get_module_centers(polygons):
+    """Returns the track_ids and the center of the polygon of each module. Longitudes are scaled by
+    the cosine of the latitude, so that Euclidean distances between centers are approximately isotropic."""
+    track_ids = list(polygons.keys())
+    centers = np.zeros((len(track_ids), 2))
+    for i, coordinates in enumerate(polygons.values()):
+        ring = np.array(coordinates[0], dtype=np.float64)[:, :2]
+        if len(ring) > 1 and np.all(ring[0] == ring[-1]):
+            ring = ring[:-1]  # closing point
+        centers[i] = ring.mean(axis=0)
+    centers[:, 0] *= np.cos(np.deg2rad(centers[:, 1]))
+    return track_ids, centers
+
+
+def get_string_neighbours(track_id, track_id_prev, string_annotation_data):
+    """Returns the modules before and after `track_id` in its string. The module in
+    walking direction (away from `track_id_prev`) comes first."""
+    if string_annotation_data is None:
+        return []
+    for string in string_annotation_data["string_data"].values():
+        track_ids = string["track_ids"]
+        try:
+            i = track_ids.index(track_id)
+        except ValueError:
+            continue
+        before = track_ids[i-1:i] if i > 0 else []
+        after = track_ids[i+1:i+2]
+        if track_id_prev in after:
+            return before + after
+        return after + before
+    return []
+
+
+class ModuleNeighbours:
+    def __init__(self, polygons):
+        self.track_ids, self.centers = get_module_centers(polygons)
+        self.index = {track_id: i for i, track_id in enumerate(self.track_ids)}
+        from sklearn.neighbors import KDTree
+        self.tree = KDTree(self.centers) if len(self.track_ids) > 0 else None
+
+    def nearest(self, point, k):
+        k = min(k, len(self.track_ids))
+        _, idxs = self.tree.query(point.reshape(1, 2), k=k)
+        return [self.track_ids[i] for i in idxs[0]]
+
+    def predict(self, track_id, track_id_prev=None, string_annotation_data=None, num_modules=4):
+        """Returns up to `num_modules` track_ids the user is likely to select after `track_id`,
+        most likely first."""
+        if self.tree is None or track_id not in self.index:
+            return []
+        center = self.centers[self.index[track_id]]
+        candidates = get_string_neighbours(track_id, track_id_prev, string_annotation_data)
+
+        # continue in the direction of the last step
+        if track_id_prev in self.index:
+            step = center - self.centers[self.index[track_id_prev]]
+            candidates += self.nearest(center + step, k=2)
+
+        candidates += self.nearest(center, k=num_modules+1)
+
+        track_ids = []
+        for candidate in candidates:
+            if candidate == track_id or candidate == track_id_prev or candidate in track_ids:
+                continue
+            track_ids.append(candidate)
+        return track_ids[:num_modules]
+
+
+
+class PrefetchWorker(QObject):
+    """Reads the patches and source frames of the requested modules into the caches.
+    A new request aborts the current one."""
+    neighbours_built = Signal(int, object)
+
+    def __init__(self):
+        super().__init__()
+        self.latest_request_id = 0  # set from the GUI thread
+
+    def is_stale(self, request_id):
+        return request_id != self.latest_request_id
+
+    @Slot(int, object)
+    def build_neighbours(self, dataset_id, polygons):
+        # built here, so that neither the sklearn import nor the tree slow down opening the dataset
+        self.neighbours_built.emit(dataset_id, ModuleNeighbours(polygons))
+
+    @Slot(int, object)
+    def prefetch(self, request_id, requests):
+        for request in requests:
+            source_frame_idx = None
+            for image_file, _ in read_module_patches(request, request["patch_cache"]):
+                if self.is_stale(request_id):
+                    return
+                if source_frame_idx is None:
+                    source_frame_idx = get_source_frame_idx(image_file)
+
+            if source_frame_idx is None:
+                continue
+            for ir_or_rgb in request["source_frames"]:
+                if self.is_stale(request_id):
+                    return
+                read_source_frame(request["dataset_dir"], source_frame_idx, ir_or_rgb, request["frame_cache"])
+
+
+
+class PrefetchController(QObject):
+    prefetch_requested = Signal(int, object)
+    neighbours_requested = Signal(int, object)
+
+    def __init__(self, model, patches_controller, num_modules=4):
+        super().__init__()
+        self.model = model
+        self.patches_controller = patches_controller
+        self.num_modules = num_modules
+        self.neighbours = None
+        self.dataset_id = 0
+        self.request_id = 0
+        self.thread = QThread()
+        self.worker = PrefetchWorker()
+        self.worker.moveToThread(self.thread)
+        self.prefetch_requested.connect(self.worker.prefetch)
+        self.neighbours_requested.connect(self.worker.build_neighbours)
+        self.worker.neighbours_built.connect(self.neighbours_built)
+        self.thread.start()
+
+    @Slot()
+    def dataset_opened(self):
+        # the module layout of module_geolocations_refined.geojson is loaded when the dataset is opened,
+        # the neighbour index is built in the worker thread and nothing is prefetched until it is ready
+        self.dataset_id += 1
+        self.neighbours = None
+        self.neighbours_requested.emit(self.dataset_id, self.model.polygons)
+
+    @Slot(int, object)
+    def neighbours_built(self, dataset_id, neighbours):
+        if dataset_id != self.dataset_id:
+            return  # dataset was closed or opened again in the meantime
+        self.neighbours = neighbours
+
+    @Slot()
+    def dataset_closed(self):
+        self.cancel()
+        self.dataset_id += 1
+        self.neighbours = None
+
+    @Slot(str, str)
+    def prefetch(self, track_id_prev, track_id):
+        self.cancel()
+        if self.neighbours is None or not self.model.dataset_is_open or track_id is None:
+            return
+
+        track_ids = self.neighbours.predict(
+            track_id,
+            track_id_prev,
+            self.model.string_editor_model.string_annotation_data,
+            self.num_modules)
+
+        source_frames = []
+        if self.model._has_ir_source_frames:
+            source_frames.append("ir")
+        if self.model._has_rgb_source_frames:
+            source_frames.append("rgb")
+
+        requests = []
+        for track_id_ in track_ids:
+            request = self.patches_controller.get_request(track_id_)
+            request["dataset_dir"] = self.model.dataset_dir
+            request["frame_cache"] = self.model.frame_cache
+            request["source_frames"] = source_frames
+            requests.append(request)
+        self.prefetch_requested.emit(self.request_id, requests)
+
+    @Slot()
+    def cancel(self):
+        # invalidates all pending requests
+        self.request_id += 1
+        self.worker.latest_request_id = self.request_id
+
+    def stop(self):
+        self.cancel()
+        self.thread.quit()
+        self.thread.wait()
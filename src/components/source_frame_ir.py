@@ -1,16 +1,14 @@
 import os
-import glob
-import re
 import pkg_resources
-import cv2
-import numpy as np
 
 from PySide6.QtWidgets import QWidget
 from PySide6.QtCore import Qt, Slot, Signal, QObject
 from PySide6.QtGui import QPixmap, QImage
 
 from ..ui.ui_source_frame import Ui_SourceFrame
-from ..utils.common import to_celsius, normalize
+from ..utils.colormap import get_ir_lut, apply_ir_lut
+from ..utils.patch_store import list_patch_files
+from ..utils.source_frames import get_source_frame_idx, read_source_frame
 
 
 class SourceFrameViewIR(QWidget):
@@ -107,35 +105,30 @@ class SourceFrameControllerIR(QObject):
         elif self.model.dataset_version == "v2":
             patches_dir = os.path.join(self.model.dataset_dir, "patches", "radiometric")        
 
-        image_files = sorted(glob.glob(os.path.join(patches_dir, self.model.track_id, "*")))
+        image_files = list_patch_files(patches_dir, self.model.track_id, self.model.patch_store, self.model.patch_index)
         image_file = image_files[0]  # TODO: set based on heuristic, e.g. select patch with maximum temperature (make setting for this in preferences)
-        source_frame_idx = int(re.findall(r'\d+', os.path.basename(image_file))[0])
-        source_frame_file = os.path.join(
-            self.model.dataset_dir, "splitted", "radiometric", "frame_{:06d}.tiff".format(source_frame_idx))
-
-        # load frame
-        source_frame = cv2.imread(source_frame_file, cv2.IMREAD_ANYDEPTH)
-        source_frame = to_celsius(source_frame, self.model.dataset_settings_model.gain, self.model.dataset_settings_model.offset)
-        source_frame = normalize(source_frame, vmin=self.model.source_frame_model_ir.min_temp, vmax=self.model.source_frame_model_ir.max_temp)
-        source_frame = cv2.cvtColor(source_frame, cv2.COLOR_GRAY2BGR)
-        if self.model.source_frame_model_ir.colormap > 0:
-            colormaps = {
-                1: cv2.COLORMAP_PLASMA,
-                2: cv2.COLORMAP_JET
-            }
-            colormap = colormaps[self.model.source_frame_model_ir.colormap]
-            source_frame = cv2.applyColorMap(source_frame, colormap)
+        source_frame_idx = get_source_frame_idx(image_file)
+
+        # load frame and render a colormapped copy of it
+        source_frame = read_source_frame(self.model.dataset_dir, source_frame_idx, "ir", self.model.frame_cache)
+        source_frame = apply_ir_lut(source_frame, get_ir_lut(
+            self.model.dataset_settings_model.gain,
+            self.model.dataset_settings_model.offset,
+            self.model.source_frame_model_ir.min_temp,
+            self.model.source_frame_model_ir.max_temp,
+            self.model.source_frame_model_ir.colormap))
 
         # load quadrilateral of module and draw onto frame using opencv
-        if self.model.ir_or_rgb == "ir":
+        if self.model.ir_or_rgb == "ir" and self.model.patch_meta is not None:  # patch meta is loaded in the background
             image_file = str.split(os.path.basename(image_file), ".")[0]
             frame_name = image_file[:12]
             mask_name = image_file[13:]
-            quadrilateral = np.array(self.model.patch_meta[(self.model.track_id, frame_name, mask_name)]["quadrilateral"])
-            source_frame = cv2.polylines(source_frame, [quadrilateral], isClosed=True, color=(0, 255, 0), thickness=3)
+            quadrilateral = self.model.patch_meta.get_quadrilateral(self.model.track_id, frame_name, mask_name)
+            if quadrilateral is not None:
+                import cv2
+                source_frame = cv2.polylines(source_frame, [quadrilateral], isClosed=True, color=(0, 255, 0), thickness=3)
 
         # update source frame
-        source_frame = cv2.cvtColor(source_frame, cv2.COLOR_BGR2RGB)
         height, width, _ = source_frame.shape
         bytesPerLine = 3 * width
         qt_source_frame = QImage(
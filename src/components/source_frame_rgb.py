@@ -1,16 +1,13 @@
 import os
-import glob
-import re
 import pkg_resources
-import cv2
-import numpy as np
 
 from PySide6.QtWidgets import QWidget
 from PySide6.QtCore import Qt, Slot, Signal, QObject
 from PySide6.QtGui import QPixmap, QImage
 
 from ..ui.ui_source_frame_rgb import Ui_SourceFrame
-from ..utils.common import to_celsius, normalize
+from ..utils.patch_store import list_patch_files
+from ..utils.source_frames import get_source_frame_idx, read_source_frame
 
 
 class SourceFrameViewRGB(QWidget):
@@ -58,6 +55,8 @@ class SourceFrameControllerRGB(QObject):
 
     @Slot()
     def update_source_frame(self):
+        import cv2
+
         if not self.model.dataset_is_open:
             self.model.source_frame_model_rgb.frame = None
             return None
@@ -71,22 +70,21 @@ class SourceFrameControllerRGB(QObject):
 
         # v1 dataset never has rgb frames, so this widget will only be active for v2 datasets
         patches_dir = os.path.join(self.model.dataset_dir, "patches", "radiometric")
-        image_files = sorted(glob.glob(os.path.join(patches_dir, self.model.track_id, "*")))
+        image_files = list_patch_files(patches_dir, self.model.track_id, self.model.patch_store, self.model.patch_index)
         image_file = image_files[0]  # TODO: set based on heuristic, e.g. select patch with maximum temperature (make setting for this in preferences)
-        source_frame_idx = int(re.findall(r'\d+', os.path.basename(image_file))[0])
-        source_frame_file = os.path.join(
-            self.model.dataset_dir, "splitted", "rgb", "frame_{:06d}.jpg".format(source_frame_idx))
+        source_frame_idx = get_source_frame_idx(image_file)
 
-        # load frame
-        source_frame = cv2.imread(source_frame_file, cv2.IMREAD_COLOR)
+        # load frame (cached frames are read-only, so draw onto a copy)
+        source_frame = read_source_frame(self.model.dataset_dir, source_frame_idx, "rgb", self.model.frame_cache).copy()
 
         # load quadrilateral of module and draw onto frame using opencv
-        if self.model.ir_or_rgb == "rgb":
+        if self.model.ir_or_rgb == "rgb" and self.model.patch_meta is not None:  # patch meta is loaded in the background
             image_file = str.split(os.path.basename(image_file), ".")[0]
             frame_name = image_file[:12]
             mask_name = image_file[13:]
-            quadrilateral = np.array(self.model.patch_meta[(self.model.track_id, frame_name, mask_name)]["quadrilateral"])
-            source_frame = cv2.polylines(source_frame, [quadrilateral], isClosed=True, color=(0, 255, 0), thickness=3)
+            quadrilateral = self.model.patch_meta.get_quadrilateral(self.model.track_id, frame_name, mask_name)
+            if quadrilateral is not None:
+                source_frame = cv2.polylines(source_frame, [quadrilateral], isClosed=True, color=(0, 255, 0), thickness=3)
 
         # update source frame
         source_frame = cv2.cvtColor(source_frame, cv2.COLOR_BGR2RGB)
@@ -1,18 +1,89 @@
+import functools
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.colors import Normalize, to_hex
 
+from .common import to_celsius, normalize
 
-def get_colors(data_column, cmap="plasma", vmin=None, vmax=None):
-    # get colors form colormap
-    colormap = plt.get_cmap(cmap, 256)
-    norm = Normalize(vmin, vmax)
-    values = np.array(list(data_column.values()))
-    colors = colormap(norm(values))
 
-    # convert to hex
-    hex_colors = {}
-    for track_id, color in zip(data_column.keys(), colors):
-        hex_colors[track_id] = to_hex(color)
+NUM_COLORS = 256
+NAN_COLOR = "#000000"
 
-    return hex_colors
\ No newline at end of file
+
+@functools.lru_cache(maxsize=None)
+def get_colormap_lut(cmap="plasma"):
+    """Returns the hex colors of the 256 entries of a matplotlib colormap. Cached per colormap."""
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import to_hex
+    colormap = plt.get_cmap(cmap, NUM_COLORS)
+    lut = np.array([to_hex(color) for color in colormap(np.arange(NUM_COLORS))])
+    lut.flags.writeable = False
+    return lut
+
+
+@functools.lru_cache(maxsize=None)
+def get_colormap_lut_packed(cmap="plasma"):
+    """Returns the colors of a colormap as packed 0xRRGGBB integers. Cached per colormap."""
+    lut = np.array([int(color[1:], 16) for color in get_colormap_lut(cmap)], dtype=np.uint32)
+    lut.flags.writeable = False
+    return lut
+
+
+def get_colormap_indices(values, vmin=None, vmax=None):
+    """Maps values linearly from [vmin, vmax] onto the entries of a colormap LUT like matplotlib.
+    Values outside the range are clipped. Returns the indices and a mask of NaN values."""
+    values = np.asarray(values, dtype=np.float64)
+    nan_mask = np.isnan(values)
+    if vmin is None:
+        vmin = np.nanmin(values) if not np.all(nan_mask) else 0.0
+    if vmax is None:
+        vmax = np.nanmax(values) if not np.all(nan_mask) else 0.0
+    if vmax == vmin:
+        normalized = np.zeros_like(values)
+    else:
+        normalized = (values - vmin) / (vmax - vmin)
+    with np.errstate(invalid="ignore"):
+        indices = np.floor(normalized * NUM_COLORS)
+    indices = np.clip(np.nan_to_num(indices), 0, NUM_COLORS - 1).astype(np.intp)
+    return indices, nan_mask
+
+
+def get_colors(values, cmap="plasma", vmin=None, vmax=None, packed=False):
+    """Returns an array with the hex color (or packed 0xRRGGBB integer if `packed`) of each value.
+    NaN values are colored black."""
+    indices, nan_mask = get_colormap_indices(values, vmin, vmax)
+    if packed:
+        colors = get_colormap_lut_packed(cmap)[indices]
+        colors[nan_mask] = int(NAN_COLOR[1:], 16)
+    else:
+        colors = get_colormap_lut(cmap)[indices]
+        colors[nan_mask] = NAN_COLOR
+    return colors
+
+
+# opencv colormaps of the IR source frame and patch views (0: gray)
+IR_COLORMAPS = {
+    1: "COLORMAP_PLASMA",
+    2: "COLORMAP_JET"
+}
+
+
+@functools.lru_cache(maxsize=16)
+def get_ir_lut(gain, offset, vmin, vmax, colormap=0):
+    """Returns a (65536, 3) uint8 lookup table mapping every raw 16 bit value of a radiometric image
+    to its RGB display color. Equivalent to converting the image to Celsius, normalizing it to
+    [vmin, vmax] and applying the colormap (see `IR_COLORMAPS`), but applied in a single lookup."""
+    import cv2
+    raw = np.arange(65536, dtype=np.uint16)
+    gray = normalize(to_celsius(raw, gain, offset), vmin=vmin, vmax=vmax)
+    colors = np.arange(256, dtype=np.uint8).reshape(256, 1)
+    colors = cv2.cvtColor(colors, cv2.COLOR_GRAY2BGR)
+    if colormap > 0:
+        colors = cv2.applyColorMap(colors, getattr(cv2, IR_COLORMAPS[colormap]))
+    colors = cv2.cvtColor(colors, cv2.COLOR_BGR2RGB).reshape(256, 3)
+    lut = colors[gray]
+    lut.flags.writeable = False
+    return lut
+
+
+def apply_ir_lut(raw, lut):
+    """Converts a raw uint16 radiometric image into an RGB image with a lookup table from `get_ir_lut`."""
+    return lut[raw]
@@ -0,0 +1,119 @@
+"""Columnar sidecar of GeoJSON data sources.
+
+Parsing a large `results.geojson` with `json.load` takes seconds, and it is
+parsed again every time the user switches data sources. After a GeoJSON file
+has been parsed once, its table (see `load_geojson_table`) and polygons are
+stored as plain `.npy` arrays in a sidecar directory, from which they are
+loaded (memory-mapped) the next time. The sidecar is only used while size and
+modification time of the GeoJSON file are unchanged.
+
+Layout of the sidecar directory:
+- `meta.json`: column names and size and modification time of the GeoJSON file
+- `track_id.npy`: index of the table
+- `column_<i>.npy`: values of the i-th column of the table
+- `polygon_track_id.npy`, `ring_counts.npy`, `ring_lengths.npy`, `points.npy`:
+  polygons with the number of rings of each polygon, the number of positions
+  of each ring and the positions of all rings
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+
+from .geojson import load_geojson_table
+
+
+def stat_file(file):
+    stat = os.stat(file)
+    return {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def save_table_columns(table, polygons, columns_dir, source_info):
+    """Writes the table and polygons into `columns_dir`. Returns False if the table can not be
+    stored in columnar form, e.g. because of columns with mixed types or missing strings."""
+    columns = {}
+    for i, column in enumerate(table.columns):
+        values = table[column].values
+        if values.dtype.kind == "O":
+            if not all(isinstance(value, str) for value in values):
+                return False
+            values = values.astype(str)
+        elif values.dtype.kind not in "fiub":
+            return False
+        columns["column_{}".format(i)] = values
+
+    polygon_track_ids = list(polygons.keys())
+    rings = [np.asarray(ring, dtype=np.float64) for coordinates in polygons.values() for ring in coordinates]
+    if len(set(ring.shape[1:] for ring in rings)) > 1 or any(ring.ndim != 2 for ring in rings):
+        return False  # positions of different dimension
+    arrays = {
+        "track_id": np.array(table.index.tolist(), dtype=str),
+        "polygon_track_id": np.array(polygon_track_ids, dtype=str),
+        "ring_counts": np.array([len(coordinates) for coordinates in polygons.values()], dtype=np.int64),
+        "ring_lengths": np.array([len(ring) for ring in rings], dtype=np.int64),
+        "points": np.concatenate(rings) if len(rings) > 0 else np.zeros((0, 2)),
+        **columns
+    }
+
+    # meta.json is written last and marks the sidecar as complete
+    shutil.rmtree(columns_dir, ignore_errors=True)
+    os.makedirs(columns_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(columns_dir, "{}.npy".format(name)), array)
+    meta = {"columns": [str(column) for column in table.columns], "source": source_info}
+    json.dump(meta, open(os.path.join(columns_dir, "meta.json"), "w"))
+    return True
+
+
+def load_table_columns(columns_dir, source_info):
+    """Returns the table and polygons stored in `columns_dir` or None if there is no sidecar
+    or it is outdated."""
+    import pandas as pd
+    try:
+        meta = json.load(open(os.path.join(columns_dir, "meta.json"), "r"))
+    except (OSError, ValueError):
+        return None
+    if meta["source"] != source_info:
+        return None
+
+    load = lambda name: np.load(os.path.join(columns_dir, "{}.npy".format(name)), mmap_mode="r")
+    data = {}
+    for i, column in enumerate(meta["columns"]):
+        values = load("column_{}".format(i))
+        if values.dtype.kind == "U":
+            values = values.astype(object)
+        data[column] = values
+    index = pd.Index(load("track_id").tolist(), name="track_id")
+    table = pd.DataFrame(data, index=index, columns=meta["columns"])
+
+    polygons = {}
+    ring_lengths = load("ring_lengths")
+    ring_offsets = np.zeros(len(ring_lengths) + 1, dtype=np.int64)
+    np.cumsum(ring_lengths, out=ring_offsets[1:])
+    ring_offsets = ring_offsets.tolist()
+    points = load("points").tolist()
+    ring = 0
+    for track_id, ring_count in zip(load("polygon_track_id").tolist(), load("ring_counts").tolist()):
+        polygons[track_id] = [
+            points[ring_offsets[i]:ring_offsets[i+1]] for i in range(ring, ring + ring_count)
+        ]
+        ring += ring_count
+    return table, polygons
+
+
+def load_geojson_table_file(geojson_file, columns_dir):
+    """Same as `load_geojson_table` for the file `geojson_file`, but uses the columnar sidecar in
+    `columns_dir` if it is up to date. Otherwise the GeoJSON file is parsed and the sidecar is created."""
+    source_info = stat_file(geojson_file)
+    result = load_table_columns(columns_dir, source_info)
+    if result is not None:
+        return result
+
+    table, polygons = load_geojson_table(open(geojson_file, "r"))
+    try:
+        if not save_table_columns(table, polygons, columns_dir, source_info):
+            print("Could not store {} in columnar form".format(geojson_file))
+    except OSError as e:
+        print("Could not save columnar sidecar {}: {}".format(columns_dir, e))
+    return table, polygons
@@ -0,0 +1,111 @@
+"""Statistics of a dataset shown in the status bar.
+
+The flight duration is the time between the first and last video frame in
+`splitted/timestamps.csv` and the trajectory length is the summed distance
+between subsequent camera positions in the pose graph `mapping/pose_graph.pkl`.
+Both files are written once by PV Hawk, so the statistics are cached in
+`<dataset_dir>/cache/dataset_stats.json` together with the modification
+times and sizes of the two files and only computed again if they change.
+"""
+
+import os
+import csv
+import json
+import pickle
+import datetime
+import numpy as np
+
+
+def get_dataset_stats_file(dataset_dir):
+    return os.path.join(dataset_dir, "cache", "dataset_stats.json")
+
+
+def get_source_files(dataset_dir):
+    return {
+        "timestamps": os.path.join(dataset_dir, "splitted", "timestamps.csv"),
+        "pose_graph": os.path.join(dataset_dir, "mapping", "pose_graph.pkl"),
+    }
+
+
+def get_source_info(source_files):
+    source_info = {}
+    for name, file in source_files.items():
+        stat = os.stat(file)
+        source_info[name] = {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+    return source_info
+
+
+def read_first_and_last_line(file, block_size=4096):
+    """Returns the first and last non-empty line of a text file without reading the lines in between."""
+    with open(file, "rb") as f:
+        first_line = f.readline()
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        tail = b""
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+            if len(tail.strip().splitlines()) > 1:
+                break
+    last_line = tail.strip().splitlines()[-1] if len(tail.strip()) > 0 else first_line
+    return first_line.decode("utf-8"), last_line.decode("utf-8")
+
+
+def get_flight_duration(timestamps_file):
+    """Returns the time between the first and last timestamp formatted as 'hh:mm:ss.sss'."""
+    first_line, last_line = read_first_and_last_line(timestamps_file)
+    first_row, last_row = csv.reader([first_line, last_line], delimiter=',', quotechar='|')
+    dt = (datetime.datetime.fromisoformat(*last_row) - datetime.datetime.fromisoformat(*first_row)).total_seconds()
+    hours, remainder = divmod(dt, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return "{:02d}:{:02d}:{:0.3f}".format(int(hours), int(minutes), seconds)
+
+
+def get_trajectory_length(pose_graph_file):
+    """Returns the summed distance between subsequent camera positions of the pose graph."""
+    pose_graph = pickle.load(open(pose_graph_file, "rb"))
+    positions = np.array([data["pose"][3:] for _, data in pose_graph.nodes(data=True)], dtype=np.float64)
+    if len(positions) < 2:
+        return 0
+    return float(np.sum(np.linalg.norm(np.diff(positions, axis=0), axis=1)))
+
+
+def compute_dataset_stats(dataset_dir, is_cancelled=lambda: False):
+    """Returns the flight duration and trajectory length of the dataset from the stats cache or computes
+    and caches them. Returns None if `is_cancelled()` becomes True."""
+    stats_file = get_dataset_stats_file(dataset_dir)
+    source_files = get_source_files(dataset_dir)
+    source_info = get_source_info(source_files)
+    try:
+        cached = json.load(open(stats_file, "r"))
+        if cached["source"] == source_info:
+            return cached["stats"]
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as e:
+        print("Could not load dataset stats {}: {}".format(stats_file, e))
+
+    flight_duration = get_flight_duration(source_files["timestamps"])
+    print("Got flight duration")
+    if is_cancelled():
+        return None
+    trajectory_length = get_trajectory_length(source_files["pose_graph"])
+    print("Got trajectory length")
+    if is_cancelled():
+        return None
+
+    stats = {
+        "flight_duration": flight_duration,
+        "trajectory_length": trajectory_length,
+    }
+    tmp_file = "{}.tmp".format(stats_file)
+    try:
+        os.makedirs(os.path.dirname(stats_file), exist_ok=True)
+        with open(tmp_file, "w") as file:
+            json.dump({"source": source_info, "stats": stats}, file)
+        os.replace(tmp_file, stats_file)
+    except OSError as e:
+        print("Could not save dataset stats {}: {}".format(stats_file, e))
+    return stats
@@ -0,0 +1,126 @@
+"""Persistent cache of per-patch features.
+
+Analyses first reduce each radiometric patch to a few raw-value features
+(e.g. minimum, maximum and mean value) and then apply their hyperparameters
+to these features. The feature cache stores the features of all patches of a
+dataset, so that re-running an analysis with different hyperparameters does
+not decode any patches.
+
+Each feature set is stored in a single file under
+`<dataset_dir>/cache/patch_features/<name>-<hash>.npz`, where the hash is
+computed from the parameters used to compute the features (e.g. the border
+margin). The cached features of a module are only used if the names,
+modification times and sizes of all its patch files are unchanged.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+
+def get_feature_cache_dir(dataset_dir):
+    return os.path.join(dataset_dir, "cache", "patch_features")
+
+
+def get_patch_names(patch_files):
+    return np.array([os.path.splitext(os.path.basename(patch_file))[0] for patch_file in patch_files], dtype=str)
+
+
+def stat_patch_files(patch_files):
+    """Returns the modification times (in ns) and sizes of the patch files."""
+    stats = [os.stat(patch_file) for patch_file in patch_files]
+    mtimes = np.array([s.st_mtime_ns for s in stats], dtype=np.int64)
+    sizes = np.array([s.st_size for s in stats], dtype=np.int64)
+    return mtimes, sizes
+
+
+class PatchFeatureCache:
+    # columns which identify the patch files, all other columns are features
+    file_columns = ("patch", "mtime", "size")
+
+    def __init__(self, dataset_dir, name, params=None):
+        self.dataset_dir = dataset_dir
+        self.name = name
+        self.params = params or {}
+        params_hash = hashlib.sha1(json.dumps(self.params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        self.cache_file = os.path.join(get_feature_cache_dir(dataset_dir), "{}-{}.npz".format(name, params_hash))
+        self.modules = {}
+        self.updated = set()
+        self.num_hits = 0
+        self.num_misses = 0
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.cache_file):
+            return
+        try:
+            data = np.load(self.cache_file)
+            track_ids = data["track_id"]
+            columns = [column for column in data.files if column != "track_id"]
+            values = {column: data[column] for column in columns}
+        except (OSError, ValueError, KeyError) as e:
+            print("Could not load feature cache {}: {}".format(self.cache_file, e))
+            return
+
+        # rows are stored sorted by track_id
+        boundaries = np.flatnonzero(track_ids[1:] != track_ids[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        stops = np.concatenate((boundaries, [len(track_ids)]))
+        for start, stop in zip(starts, stops):
+            if start == stop:
+                continue
+            self.modules[str(track_ids[start])] = {column: values[column][start:stop] for column in columns}
+
+    def save(self):
+        """Writes the cache to disk if it has been updated."""
+        if len(self.updated) == 0 or len(self.modules) == 0:
+            return
+        track_ids = sorted(self.modules.keys())
+        columns = list(self.modules[track_ids[0]].keys())
+        data = {"track_id": np.repeat(
+            np.array(track_ids, dtype=str),
+            [len(self.modules[track_id]["patch"]) for track_id in track_ids])}
+        for column in columns:
+            data[column] = np.concatenate([self.modules[track_id][column] for track_id in track_ids])
+
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_file = "{}.tmp".format(self.cache_file)
+        with open(tmp_file, "wb") as file:
+            np.savez(file, **data)
+        os.replace(tmp_file, self.cache_file)
+        self.updated = set()
+        print("Saved features of {} modules in {}".format(len(track_ids), self.cache_file))
+
+    def get_or_compute(self, track_id, patch_files, compute_features):
+        """Returns the cached features of the patches of a module or computes them with
+        `compute_features(patch_files)` if the cache entry is missing or outdated. The features
+        are a dict of arrays with one entry per patch file."""
+        patch_names = get_patch_names(patch_files)
+        mtimes, sizes = stat_patch_files(patch_files)
+        entry = self.modules.get(track_id)
+        if (entry is not None
+                and np.array_equal(entry["patch"], patch_names)
+                and np.array_equal(entry["mtime"], mtimes)
+                and np.array_equal(entry["size"], sizes)):
+            self.num_hits += 1
+            return {column: values for column, values in entry.items() if column not in self.file_columns}
+
+        self.num_misses += 1
+        features = compute_features(patch_files)
+        entry = {"patch": patch_names, "mtime": mtimes, "size": sizes}
+        for column, values in features.items():
+            entry[column] = np.asarray(values)
+        self.modules[track_id] = entry
+        self.updated.add(track_id)
+        return features
+
+    def take_updates(self):
+        """Returns the entries updated since the last call. Used to merge the results of worker processes."""
+        updates = {track_id: self.modules[track_id] for track_id in self.updated}
+        self.updated = set()
+        return updates
+
+    def merge(self, updates):
+        self.modules.update(updates)
+        self.updated |= set(updates.keys())
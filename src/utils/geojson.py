@@ -1,12 +1,11 @@
+import os
 import json
+import functools
 import numpy as np
-import pandas as pd
-from shapely.geometry import shape, mapping
-from shapely.ops import transform
-import pyproj
 
 
 def load_geojson(fp):
+    import pandas as pd
     data = json.load(fp)
     df = []
     for feature in data["features"]:
@@ -20,59 +19,147 @@ def load_geojson(fp):
     return df
 
 
-def save_geojson(df, fp):
-    """Takes a pandas DataFrame with a 'geometry' column containing shapely geometries in WGS84 coordinates.
-    Each row of the dataframe represents one GeoJSON feature. The dataframe may contian additional columns, 
-    which are written into the properties of the feature."""
-    features = []
+def load_geojson_table(fp):
+    """Loads the properties of all features into a table indexed by track_id with one column per property.
+    Properties of features with the same track_id (e.g. the polygon and center point of a module) are merged.
+    Returns the table and a dict mapping the track_id of each polygon feature to its coordinates."""
+    import pandas as pd
+    data = json.load(fp)
+    properties = []
+    polygons = {}
+    for feature in data["features"]:
+        properties.append(feature["properties"])
+        if feature["geometry"]["type"] == "Polygon":
+            polygons[feature["properties"]["track_id"]] = feature["geometry"]["coordinates"]
+    table = pd.DataFrame.from_records(properties)
+    if len(table) == 0:
+        table = pd.DataFrame(columns=["track_id"])
+    table = table.groupby("track_id", sort=False).last()
+    return table, polygons
+
+
+def encode_json_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return "null"
+    return json.dumps(value)
+
 
+def encode_json_column(values):
+    """Returns the JSON encoding of each value of a column like `json.dumps`, but vectorized for
+    numeric columns. NaN values are encoded as null."""
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        encoded = np.array(list(map(float.__repr__, values.astype(np.float64).tolist())), dtype=object)
+        encoded[np.isposinf(values)] = "Infinity"
+        encoded[np.isneginf(values)] = "-Infinity"
+        encoded[np.isnan(values)] = "null"
+        return encoded
+    if values.dtype.kind in "iu":
+        return np.array(list(map(int.__repr__, values.tolist())), dtype=object)
+    if values.dtype.kind == "b":
+        return np.where(values, "true", "false").astype(object)
+    return np.array([encode_json_value(value) for value in values], dtype=object)
+
+
+def save_geojson(df, fp, batch_size=1000):
+    """Takes a pandas DataFrame with a 'geometry' column containing GeoJSON geometries in WGS84 coordinates.
+    Each row of the dataframe represents one GeoJSON feature. The dataframe may contian additional columns, 
+    which are written into the properties of the feature. Features are encoded column by column and
+    written to `fp` in batches of `batch_size`. The output is the same as with `json.dump`."""
     df = df.reset_index()
-    df = df.replace({np.nan: None})  # replace nan with None
-    records = df.to_dict('records')
-    for record in records:
-        # assemble feature
-        feature = {
-            'type': 'Feature',
-            'geometry': {
-                'type': record['geometry_type'],
-                'coordinates': record['geometry']["coordinates"]
-            },
-            'properties': {}
-        }
-        
-        # insert properties
-        for k, v in record.items():
-            if k in ['index', 'level_0', 'geometry', 'geometry_type']:
-                continue
-            feature['properties'][k] = v            
-        
-        features.append(feature)
-    
-    geojson = {
-        'type': 'FeatureCollection',
-        'crs': {
-            'type': 'name',
-            'properties': {
-                'name': 'urn:ogc:def:crs:OGC:1.3:CRS84'
-            }
-        },
-        'features': features
-    }
-    json.dump(geojson, fp)
+    property_columns = [
+        column for column in df.columns
+        if column not in ['index', 'level_0', 'geometry', 'geometry_type']
+    ]
+    keys = ["{}: ".format(json.dumps(str(column))) for column in property_columns]
+    geometry_types = encode_json_column(df["geometry_type"].values)
+    geometries = df["geometry"].values
+    columns = [encode_json_column(df[column].values) for column in property_columns]
 
+    fp.write('{"type": "FeatureCollection", "crs": {"type": "name", "properties": '
+        '{"name": "urn:ogc:def:crs:OGC:1.3:CRS84"}}, "features": [')
+    for start in range(0, len(df), batch_size):
+        features = []
+        for i in range(start, min(start + batch_size, len(df))):
+            properties = ", ".join([key + column[i] for key, column in zip(keys, columns)])
+            features.append('{{"type": "Feature", "geometry": {{"type": {}, "coordinates": {}}}, "properties": {{{}}}}}'.format(
+                geometry_types[i], json.dumps(geometries[i]["coordinates"]), properties))
+        if start > 0:
+            fp.write(", ")
+        fp.write(", ".join(features))
+    fp.write("]}")
 
-def coords_wgs84_to_ltp(df):
-    """Convert dataframe from WGS84 to LTP."""
+
+def save_geojson_file(df, file):
+    """Writes the dataframe into the GeoJSON file `file` (see `save_geojson`). The file is written
+    to a temporary file first, so that `file` is never left half-written."""
+    tmp_file = "{}.tmp".format(file)
+    with open(tmp_file, "w") as fp:
+        save_geojson(df, fp)
+    os.replace(tmp_file, file)
+
+
+@functools.lru_cache(maxsize=None)
+def get_wgs84_to_ltp_transformer():
+    import pyproj
     wgs84 = pyproj.CRS('EPSG:4326')
     ltp = pyproj.CRS('EPSG:3857')
-    projection = pyproj.Transformer.from_crs(wgs84, ltp, always_xy=True).transform
-    # apply transform
+    return pyproj.Transformer.from_crs(wgs84, ltp, always_xy=True)
+
+
+def flatten_coordinates(coordinates):
+    """Returns the positions of a GeoJSON coordinate array as a (N, D) array and its shape, which is
+    needed to restore the nesting (see `restore_coordinates`). Ragged arrays (e.g. polygons with holes)
+    are flattened part by part and their shape is a list of the shapes of the parts."""
+    try:
+        positions = np.asarray(coordinates, dtype=np.float64)
+    except ValueError:
+        parts = [flatten_coordinates(part) for part in coordinates]
+        return np.concatenate([positions for positions, _ in parts]), [shape for _, shape in parts]
+    return positions.reshape(-1, positions.shape[-1]), positions.shape
+
+
+def num_positions(shape):
+    if isinstance(shape, tuple):
+        return int(np.prod(shape[:-1]))
+    return sum(num_positions(part_shape) for part_shape in shape)
+
+
+def restore_coordinates(positions, shape):
+    """Inverse of `flatten_coordinates`. Returns nested lists."""
+    if isinstance(shape, tuple):
+        return positions.reshape(shape).tolist()
+    coordinates = []
+    start = 0
+    for part_shape in shape:
+        stop = start + num_positions(part_shape)
+        coordinates.append(restore_coordinates(positions[start:stop], part_shape))
+        start = stop
+    return coordinates
+
+
+def coords_wgs84_to_ltp(df):
+    """Convert dataframe from WGS84 to LTP. The positions of all geometries are projected in a single batch."""
+    flattened = [flatten_coordinates(geometry["coordinates"]) for geometry in df.loc[:, "geometry"]]
+    lengths = [len(positions) for positions, _ in flattened]
+    x = np.concatenate([positions[:, 0] for positions, _ in flattened] + [np.zeros(0)])
+    y = np.concatenate([positions[:, 1] for positions, _ in flattened] + [np.zeros(0)])
+    x, y = get_wgs84_to_ltp_transformer().transform(x, y)
+
+    # scatter the projected positions back into the geometries, other dimensions (e.g. altitude) are kept
     geometry_transformed = []
-    for geometry in df.loc[:, "geometry"]:
-        geometry = transform(projection, shape(geometry))
-        geometry = mapping(geometry)
-        geometry["coordinates"] = np.array(geometry["coordinates"]).tolist()
-        geometry_transformed.append(geometry)
+    start = 0
+    for geometry, (positions, shape), length in zip(df.loc[:, "geometry"], flattened, lengths):
+        positions = positions.copy()
+        positions[:, 0] = x[start:start+length]
+        positions[:, 1] = y[start:start+length]
+        start += length
+        geometry_transformed.append({
+            "type": geometry["type"],
+            "coordinates": restore_coordinates(positions, shape)
+        })
     df_transformed = df.copy()
     df_transformed.loc[:, "geometry"] = geometry_transformed
-    return df_transformed
\ No newline at end of file
+    return df_transformed
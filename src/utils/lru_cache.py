@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def get_nbytes(value):
+    """Returns the number of bytes of all numpy arrays in `value`, which may be nested in tuples and lists."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(get_nbytes(item) for item in value)
+    return 0
+
+
+class LRUCache:
+    """Thread-safe cache holding at most `maxsize` items whose numpy arrays occupy at most `max_bytes`
+    (see `get_nbytes`). When full, the least recently used items are evicted. Both limits are optional."""
+    def __init__(self, maxsize=None, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.item_nbytes = {}
+        self.nbytes = 0
+        self.num_hits = 0
+        self.num_misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                self.items.move_to_end(key)
+            except KeyError:
+                self.num_misses += 1
+                return default
+            self.num_hits += 1
+            return self.items[key]
+
+    def put(self, key, value):
+        nbytes = get_nbytes(value)
+        with self.lock:
+            if key in self.items:
+                self.nbytes -= self.item_nbytes[key]
+            elif self.max_bytes is not None and nbytes > self.max_bytes:
+                return  # would evict everything else
+            self.items[key] = value
+            self.items.move_to_end(key)
+            self.item_nbytes[key] = nbytes
+            self.nbytes += nbytes
+            while ((self.maxsize is not None and len(self.items) > self.maxsize) or
+                   (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                key_, _ = self.items.popitem(last=False)
+                self.nbytes -= self.item_nbytes.pop(key_)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.item_nbytes.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return "{} items, {:.1f} MB, {} hits, {} misses".format(
+                len(self.items), self.nbytes / 1024**2, self.num_hits, self.num_misses)
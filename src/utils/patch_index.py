@@ -0,0 +1,119 @@
+"""Index of the patch files of each module.
+
+Listing the patches of a module with `glob` is a directory scan per call,
+and the viewer and analyses do so for every module over and over. The patch
+index is built once when a dataset is opened with a single `os.scandir` pass
+over the patches directory. It maps each track_id to the sorted file names of
+its patches, from which the frame indices and mask names are derived.
+
+The index is persisted in `<dataset_dir>/cache/patch_index.json` together with
+the modification time of each module directory. When the index is opened,
+only directories whose modification time changed are scanned again.
+"""
+
+import os
+import json
+
+from .patch_store import split_patch_name
+
+
+def get_patch_index_file(dataset_dir):
+    return os.path.join(dataset_dir, "cache", "patch_index.json")
+
+
+def scan_patches_dir(patches_dir):
+    """Returns the modification time (in ns) of each module directory in `patches_dir`."""
+    mtimes = {}
+    with os.scandir(patches_dir) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                mtimes[entry.name] = entry.stat().st_mtime_ns
+    return mtimes
+
+
+def scan_module_dir(module_dir):
+    """Returns the sorted names of the patch files in a module directory (like `sorted(glob.glob(...))`)."""
+    with os.scandir(module_dir) as entries:
+        return sorted(entry.name for entry in entries if not entry.name.startswith(".") and entry.is_file())
+
+
+class PatchIndex:
+    def __init__(self, file_names, mtimes):
+        self.file_names = file_names  # track_id -> sorted file names of the patches
+        self.mtimes = mtimes  # track_id -> modification time of the module directory
+        self.track_ids = sorted(file_names.keys())
+        self.num_patches = sum(len(names) for names in file_names.values())
+
+    @classmethod
+    def open(cls, dataset_dir, patches_dir, is_cancelled=lambda: False):
+        """Loads the persisted index of the dataset, rescans all modules whose directory changed
+        and saves the index again if anything changed. Returns None if `is_cancelled()` becomes True."""
+        index_file = get_patch_index_file(dataset_dir)
+        cached = {}
+        try:
+            cached = json.load(open(index_file, "r"))["modules"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print("Could not load patch index {}: {}".format(index_file, e))
+
+        file_names = {}
+        mtimes = scan_patches_dir(patches_dir)
+        num_scanned = 0
+        for track_id, mtime in mtimes.items():
+            if is_cancelled():
+                return None
+            entry = cached.get(track_id)
+            if entry is not None and entry["mtime"] == mtime:
+                file_names[track_id] = entry["file_names"]
+            else:
+                file_names[track_id] = scan_module_dir(os.path.join(patches_dir, track_id))
+                num_scanned += 1
+
+        patch_index = cls(file_names, mtimes)
+        if num_scanned > 0 or len(cached) != len(mtimes):
+            print("Scanned {} of {} module directories for the patch index".format(num_scanned, len(mtimes)))
+            patch_index.save(index_file)
+        return patch_index
+
+    def save(self, index_file):
+        modules = {
+            track_id: {"mtime": self.mtimes[track_id], "file_names": self.file_names[track_id]}
+            for track_id in self.track_ids
+        }
+        tmp_file = "{}.{}.tmp".format(index_file, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(index_file), exist_ok=True)
+            with open(tmp_file, "w") as file:
+                json.dump({"modules": modules}, file)
+            os.replace(tmp_file, index_file)
+        except OSError as e:
+            print("Could not save patch index {}: {}".format(index_file, e))
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    def __contains__(self, track_id):
+        return track_id in self.file_names
+
+    def get_patch_names(self, track_id):
+        """Returns the sorted patch names ('frame_000000_mask_000000') of a module."""
+        return [os.path.splitext(file_name)[0] for file_name in self.file_names.get(track_id, [])]
+
+    def get_frame_names(self, track_id):
+        return [split_patch_name(patch_name)[0] for patch_name in self.get_patch_names(track_id)]
+
+    def get_mask_names(self, track_id):
+        return [split_patch_name(patch_name)[1] for patch_name in self.get_patch_names(track_id)]
+
+    def get_frame_idxs(self, track_id):
+        """Returns the indices of the video frames from which the patches of a module were extracted."""
+        return [int(frame_name[6:]) for frame_name in self.get_frame_names(track_id)]
+
+    def list_patch_files(self, patches_dir, track_id):
+        """Returns the sorted patch file paths of a module or None if the module is not in the index."""
+        try:
+            file_names = self.file_names[track_id]
+        except KeyError:
+            return None
+        return [os.path.join(patches_dir, track_id, file_name) for file_name in file_names]
@@ -0,0 +1,173 @@
+"""Compact storage of the quadrilaterals of all patches.
+
+PV Hawk stores the metadata of all patches as a pickled dict keyed by
+(track_id, frame_name, mask_name). For large plants, unpickling this dict is
+slow and keeps several GB of Python objects in memory, although the viewer
+only needs the quadrilateral of one patch at a time.
+
+The first time a dataset is opened, the quadrilaterals are converted into
+three numpy arrays under `<dataset_dir>/cache/patch_meta`: the sorted keys,
+the int32 points of all quadrilaterals and the offset of the first point of
+each quadrilateral. The arrays are memory-mapped and looked up with a binary
+search. They are converted again if the pickle file changes. If the cache can
+not be written, the converted arrays are kept in memory instead.
+"""
+
+import os
+import json
+import pickle
+import numpy as np
+
+
+def get_patch_meta_file(dataset_dir, dataset_version):
+    """Returns the pickle file with the metadata of all patches."""
+    if dataset_version == "v1":
+        return os.path.join(dataset_dir, "patches", "meta.pkl")
+    elif dataset_version == "v2":
+        return os.path.join(dataset_dir, "quadrilaterals", "quadrilaterals.pkl")
+
+
+def get_patch_meta_dir(dataset_dir):
+    return os.path.join(dataset_dir, "cache", "patch_meta")
+
+
+def make_key(track_id, frame_name, mask_name):
+    return "{}/{}/{}".format(track_id, frame_name, mask_name)
+
+
+def get_source_info(patch_meta_file):
+    stat = os.stat(patch_meta_file)
+    return {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+
+
+class Cancelled(Exception):
+    pass
+
+
+class CancellableReader:
+    """Wraps a binary file and raises `Cancelled` on the next read once `is_cancelled()` is True.
+    This allows to interrupt a long `pickle.load`, which reads the file in blocks."""
+    def __init__(self, file, is_cancelled):
+        self.file = file
+        self.is_cancelled = is_cancelled
+
+    def check(self):
+        if self.is_cancelled():
+            raise Cancelled()
+
+    def read(self, size=-1):
+        self.check()
+        return self.file.read(size)
+
+    def readinto(self, buffer):
+        self.check()
+        return self.file.readinto(buffer)
+
+    def readline(self, size=-1):
+        self.check()
+        return self.file.readline(size)
+
+    def peek(self, size=0):
+        return self.file.peek(size)
+
+
+class PatchMeta:
+    def __init__(self, keys, offsets, points):
+        self.keys = keys
+        self.offsets = offsets
+        self.points = points
+
+    @classmethod
+    def load(cls, meta_dir):
+        """Memory-maps the converted patch metadata in `meta_dir`."""
+        return cls(*[
+            np.load(os.path.join(meta_dir, "{}.npy".format(name)), mmap_mode="r")
+            for name in ["keys", "offsets", "points"]
+        ])
+
+    @classmethod
+    def open(cls, dataset_dir, dataset_version, is_cancelled=lambda: False):
+        """Returns the compact patch metadata of the dataset. Converts the pickle file first if
+        no up-to-date conversion exists. Returns None if `is_cancelled()` becomes True during
+        the conversion."""
+        patch_meta_file = get_patch_meta_file(dataset_dir, dataset_version)
+        meta_dir = get_patch_meta_dir(dataset_dir)
+        source_info = get_source_info(patch_meta_file)
+        try:
+            with open(os.path.join(meta_dir, "source.json"), "r") as file:
+                if json.load(file) == source_info:
+                    return cls.load(meta_dir)
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print("Could not load patch metadata from {}: {}".format(meta_dir, e))
+
+        print("Converting patch metadata {}".format(patch_meta_file))
+        try:
+            with open(patch_meta_file, "rb") as file:
+                patch_meta = pickle.load(CancellableReader(file, is_cancelled))
+        except Cancelled:
+            print("Cancelled converting patch metadata")
+            return None
+        if is_cancelled():
+            return None
+        arrays = cls.convert(patch_meta)
+        del patch_meta
+        try:
+            cls.save(arrays, meta_dir, source_info)
+        except OSError as e:
+            print("Could not save patch metadata {}: {}".format(meta_dir, e))
+            return cls(*arrays)  # kept in memory until the dataset is closed
+        return cls.load(meta_dir)
+
+    @staticmethod
+    def convert(patch_meta):
+        """Returns the sorted keys, offsets and points of the quadrilaterals of the patch metadata
+        dict `patch_meta`."""
+        keys = np.array([make_key(*key) for key in patch_meta.keys()], dtype=str)
+        quadrilaterals = [
+            np.asarray(meta["quadrilateral"], dtype=np.int32).reshape(-1, 2)
+            for meta in patch_meta.values()
+        ]
+        order = np.argsort(keys, kind="stable")
+        lengths = np.array([len(quadrilaterals[i]) for i in order], dtype=np.int64)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        points = np.concatenate(
+            [quadrilaterals[i] for i in order] + [np.zeros((0, 2), dtype=np.int32)])
+        return keys[order], offsets, points
+
+    @staticmethod
+    def save(arrays, meta_dir, source_info):
+        """Writes the keys, offsets and points returned by `convert` into `meta_dir`."""
+        os.makedirs(meta_dir, exist_ok=True)
+        # source.json is written last, so an interrupted conversion is redone
+        source_file = os.path.join(meta_dir, "source.json")
+        if os.path.isfile(source_file):
+            os.remove(source_file)
+        for name, array in zip(["keys", "offsets", "points"], arrays):
+            tmp_file = os.path.join(meta_dir, "{}.tmp.npy".format(name))
+            np.save(tmp_file, array)
+            os.replace(tmp_file, os.path.join(meta_dir, "{}.npy".format(name)))
+        with open(source_file, "w") as file:
+            json.dump(source_info, file)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, track_id, frame_name, mask_name):
+        """Returns the row of a patch or None if it is not in the metadata."""
+        key = make_key(track_id, frame_name, mask_name)
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return i
+        return None
+
+    def __contains__(self, key):
+        return self.find(*key) is not None
+
+    def get_quadrilateral(self, track_id, frame_name, mask_name):
+        """Returns the (N, 2) int32 points of the quadrilateral of a patch or None if it is not in the metadata."""
+        i = self.find(track_id, frame_name, mask_name)
+        if i is None:
+            return None
+        return np.array(self.points[self.offsets[i]:self.offsets[i+1]])
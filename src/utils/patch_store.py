@@ -0,0 +1,239 @@
+"""Packed storage of the radiometric patches of a dataset.
+
+Reading the patches of a large PV plant from disk is dominated by filesystem
+metadata lookups and TIFF decoding of many small files. The patch store packs
+all radiometric patches of a dataset once into a single uint16 blob and an
+index of offsets and shapes keyed by (track_id, frame, mask). The blob is
+memory-mapped and patches are served as zero-copy numpy views.
+
+The store lives under `<dataset_dir>/cache/patch_store`. If it exists, all
+patch loaders use it transparently. Otherwise, patches are read from disk.
+The index records the modification time of each module directory, and
+modules whose directory changed since the store was built are read from disk.
+"""
+
+import os
+import glob
+import datetime
+import numpy as np
+
+from PySide6.QtCore import QObject, Signal
+
+from .common import get_immediate_subdirectories
+
+
+def get_patch_store_dir(dataset_dir):
+    return os.path.join(dataset_dir, "cache", "patch_store")
+
+
+def split_patch_name(patch_name):
+    """Splits a patch name of the form 'frame_000000_mask_000000' into frame name and mask name."""
+    return patch_name[:12], patch_name[13:]
+
+
+class PatchStore:
+    def __init__(self, store_dir, index, valid):
+        """Use `PatchStore.open`. Only the patches of modules marked in the boolean array `valid`
+        are served from the store, the others are read from disk."""
+        self.store_dir = store_dir
+        self.track_ids = index["track_id"]
+        self.patch_names = index["patch_name"]
+        self.offsets = index["offset"]
+        self.shapes = index["shape"]
+        self.blob = np.memmap(os.path.join(store_dir, "patches.bin"), dtype=np.uint16, mode="r")
+
+        # patches are stored ordered by track_id and patch name
+        self.lookup = {}
+        self.track_slices = {}
+        valid_idxs = np.flatnonzero(valid)
+        track_ids = self.track_ids[valid_idxs].tolist()
+        patch_names = self.patch_names[valid_idxs].tolist()
+        for i, track_id, patch_name in zip(valid_idxs.tolist(), track_ids, patch_names):
+            frame_name, mask_name = split_patch_name(patch_name)
+            self.lookup[(track_id, frame_name, mask_name)] = i
+            start, _ = self.track_slices.get(track_id, (i, i))
+            self.track_slices[track_id] = (start, i+1)
+
+    @classmethod
+    def open(cls, dataset_dir, patches_dir):
+        """Returns the patch store of the dataset or None if no valid store exists. Modules whose
+        directory changed since the store was built are left out and read from disk."""
+        from .patch_index import scan_patches_dir
+        store_dir = get_patch_store_dir(dataset_dir)
+        index_file = os.path.join(store_dir, "index.npz")
+        if not os.path.isfile(index_file):
+            return None
+        index = dict(np.load(index_file))
+        if "module_mtime" not in index:
+            print("Patch store in {} is outdated, reading patches from disk".format(store_dir))
+            return None
+
+        # compare the modification time of each module directory before building the lookup
+        mtimes = scan_patches_dir(patches_dir)
+        stored_mtimes = dict(zip(index["module_track_id"].tolist(), index["module_mtime"].tolist()))
+        valid_track_ids = [
+            track_id for track_id, mtime in stored_mtimes.items() if mtimes.get(track_id) == mtime]
+        if len(valid_track_ids) == 0:
+            print("Patch store in {} is outdated, reading patches from disk".format(store_dir))
+            return None
+        if len(valid_track_ids) < len(stored_mtimes):
+            print("{} of {} modules in patch store {} are outdated, reading them from disk".format(
+                len(stored_mtimes) - len(valid_track_ids), len(stored_mtimes), store_dir))
+        valid = np.isin(index["track_id"], valid_track_ids)
+        return cls(store_dir, index, valid)
+
+    def __len__(self):
+        return len(self.patch_names)
+
+    def __contains__(self, key):
+        return key in self.lookup
+
+    def get(self, track_id, frame_name, mask_name):
+        """Returns a read-only view of the patch or None if it is not in the store."""
+        try:
+            i = self.lookup[(track_id, frame_name, mask_name)]
+        except KeyError:
+            return None
+        offset = self.offsets[i]
+        height, width = self.shapes[i]
+        return self.blob[offset:offset+height*width].reshape(height, width)
+
+    def read(self, patch_file):
+        """Returns the patch corresponding to the file path `patch_file` or None if it is not in the store."""
+        track_id = os.path.basename(os.path.dirname(patch_file))
+        patch_name = os.path.splitext(os.path.basename(patch_file))[0]
+        return self.get(track_id, *split_patch_name(patch_name))
+
+    def list_patch_files(self, patches_dir, track_id):
+        """Returns the sorted patch file paths of a module or None if the module is not in the store."""
+        try:
+            start, stop = self.track_slices[track_id]
+        except KeyError:
+            return None
+        return [
+            os.path.join(patches_dir, track_id, "{}.tiff".format(patch_name))
+            for patch_name in self.patch_names[start:stop].tolist()
+        ]
+
+
+def read_patch(patch_file, patch_store=None):
+    """Reads a radiometric patch from the patch store if available, otherwise from disk."""
+    if patch_store is not None:
+        patch = patch_store.read(patch_file)
+        if patch is not None:
+            return patch
+    import cv2
+    return cv2.imread(patch_file, cv2.IMREAD_ANYDEPTH)
+
+
+def list_patch_files(patches_dir, track_id, patch_store=None, patch_index=None):
+    """Returns the sorted patch file paths of a module from the patch index or patch store if available,
+    otherwise from disk."""
+    if patch_index is not None:
+        patch_files = patch_index.list_patch_files(patches_dir, track_id)
+        if patch_files is not None:
+            return patch_files
+    if patch_store is not None:
+        patch_files = patch_store.list_patch_files(patches_dir, track_id)
+        if patch_files is not None:
+            return patch_files
+    return sorted(glob.glob(os.path.join(patches_dir, track_id, "*")))
+
+
+
+class BuildPatchStoreWorker(QObject):
+    finished = Signal()
+    progress = Signal(float, bool, str)
+
+    def __init__(self, dataset_dir, dataset_version):
+        super().__init__()
+        self.is_cancelled = False
+        self.dataset_dir = dataset_dir
+        self.dataset_version = dataset_version
+
+    def run(self):
+        store_dir = get_patch_store_dir(self.dataset_dir)
+        blob_file = os.path.join(store_dir, "patches.bin")
+        index_file = os.path.join(store_dir, "index.npz")
+        tmp_files = ["{}.tmp".format(blob_file), "{}.tmp".format(index_file)]
+        try:
+            self.build(store_dir, blob_file, index_file)
+        except Exception as e:
+            print("Could not build patch store in {}: {}".format(store_dir, e))
+            self.progress.emit(1, True, "Could not build patch store: {}".format(e))
+        finally:
+            # left over if the build was cancelled or failed
+            for tmp_file in tmp_files:
+                try:
+                    os.remove(tmp_file)
+                except OSError:
+                    pass
+            self.finished.emit()
+
+    def build(self, store_dir, blob_file, index_file):
+        import cv2
+        if self.dataset_version == "v1":
+            patches_dir = os.path.join(self.dataset_dir, "patches_final", "radiometric")
+        elif self.dataset_version == "v2":
+            patches_dir = os.path.join(self.dataset_dir, "patches", "radiometric")
+        else:
+            raise ValueError("Unknown dataset version {}".format(self.dataset_version))
+
+        os.makedirs(store_dir, exist_ok=True)
+        track_ids = []
+        patch_names = []
+        offsets = []
+        shapes = []
+        offset = 0
+        module_mtimes = []
+        progress = 0
+        with open("{}.tmp".format(blob_file), "wb") as blob:
+            track_ids_ = sorted(get_immediate_subdirectories(patches_dir))
+            for i, track_id in enumerate(track_ids_):
+                progress = i / len(track_ids_)
+                if self.is_cancelled:
+                    break
+
+                # taken before reading, so that changes during the build mark the module as outdated
+                module_mtimes.append(os.stat(os.path.join(patches_dir, track_id)).st_mtime_ns)
+                for patch_file in sorted(glob.glob(os.path.join(patches_dir, track_id, "*.tiff"))):
+                    patch = cv2.imread(patch_file, cv2.IMREAD_ANYDEPTH)
+                    if patch is None or patch.dtype != np.uint16:
+                        continue
+                    blob.write(np.ascontiguousarray(patch).tobytes())
+                    track_ids.append(track_id)
+                    patch_names.append(os.path.splitext(os.path.basename(patch_file))[0])
+                    offsets.append(offset)
+                    shapes.append(patch.shape)
+                    offset += patch.size
+
+                self.progress.emit(progress, False, "Building patch store...")
+
+        if self.is_cancelled:
+            self.progress.emit(progress, True, "Cancelled")
+            return
+
+        if len(patch_names) == 0:
+            print("No radiometric patches found, not building patch store")
+            self.progress.emit(1, False, "Done")
+            return
+
+        with open("{}.tmp".format(index_file), "wb") as index:
+            np.savez(
+                index,
+                track_id=np.array(track_ids),
+                patch_name=np.array(patch_names),
+                offset=np.array(offsets, dtype=np.int64),
+                shape=np.array(shapes, dtype=np.int32).reshape(-1, 2),
+                module_track_id=np.array(track_ids_),
+                module_mtime=np.array(module_mtimes, dtype=np.int64),
+                timestamp=np.array(datetime.datetime.utcnow().isoformat()))
+        # without an index the store is ignored, so a failure in between never pairs the new
+        # blob with the old index
+        if os.path.isfile(index_file):
+            os.remove(index_file)
+        os.replace("{}.tmp".format(blob_file), blob_file)
+        os.replace("{}.tmp".format(index_file), index_file)
+        print("Saved patch store with {} patches in {}".format(len(patch_names), store_dir))
+
+        self.progress.emit(1, False, "Done")
@@ -0,0 +1,114 @@
+"""Vectorized reductions over variable-length segments of a flat array.
+
+A collection of variable-length arrays (e.g. the pixels of differently sized
+patches or the temperatures of the neighbours of each module) is represented
+by the concatenation `values` of all arrays and the `lengths` of the
+individual segments. All functions return one value per segment and NaN for
+empty segments.
+"""
+
+import numpy as np
+
+
+def segment_ids(lengths):
+    """Returns the segment index of each element of the concatenated values."""
+    return np.repeat(np.arange(len(lengths)), lengths)
+
+
+def segment_starts(lengths):
+    """Returns the index of the first element of each segment in the concatenated values."""
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    return starts
+
+
+def segment_sort(values, lengths):
+    """Sorts the values within each segment."""
+    if np.issubdtype(values.dtype, np.unsignedinteger) and values.dtype.itemsize <= 4:
+        # pack segment index and value into a single key, which sorts faster than lexsort
+        shift = np.uint64(8 * values.dtype.itemsize)
+        keys = (segment_ids(lengths).astype(np.uint64) << shift) | values.astype(np.uint64)
+        keys.sort()
+        return (keys & np.uint64((1 << int(shift)) - 1)).astype(values.dtype)
+    # sorting all values once and then the segment index combined with the rank of each value
+    # within all values is faster than lexsort
+    order = np.argsort(values)
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[order] = np.arange(len(values))
+    keys = segment_ids(lengths).astype(np.int64) * len(values) + ranks
+    keys.sort()
+    return values[order[keys % max(1, len(values))]]
+
+
+def _reduce(ufunc, values, lengths, dtype=None):
+    lengths = np.asarray(lengths, dtype=np.int64)
+    result = np.full(len(lengths), np.nan)
+    nonempty = lengths > 0
+    if np.any(nonempty):
+        values = values if dtype is None else values.astype(dtype)
+        result[nonempty] = ufunc.reduceat(values, segment_starts(lengths)[nonempty])
+    return result
+
+
+def segment_min(values, lengths):
+    return _reduce(np.minimum, values, lengths)
+
+
+def segment_max(values, lengths):
+    return _reduce(np.maximum, values, lengths)
+
+
+def segment_sum(values, lengths):
+    # integer values are summed exactly
+    dtype = np.int64 if np.issubdtype(values.dtype, np.integer) else np.float64
+    return _reduce(np.add, values, lengths, dtype)
+
+
+def segment_mean(values, lengths):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return segment_sum(values, lengths) / lengths
+
+
+def segment_median(sorted_values, lengths):
+    """Median of each segment of `sorted_values`, which must be sorted within each segment (see `segment_sort`).
+    Identical to `np.median` applied to each segment."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    result = np.full(len(lengths), np.nan)
+    nonempty = lengths > 0
+    starts = segment_starts(lengths)[nonempty]
+    lengths = lengths[nonempty]
+    lo = sorted_values[starts + (lengths - 1) // 2].astype(np.float64)
+    hi = sorted_values[starts + lengths // 2].astype(np.float64)
+    result[nonempty] = (lo + hi) / 2
+    return result
+
+
+def segment_quantile(sorted_values, lengths, q):
+    """Quantile `q` (between 0 and 1) of each segment of `sorted_values`, which must be sorted within each
+    segment (see `segment_sort`). Uses linear interpolation between the closest ranks like `np.quantile`."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    result = np.full(len(lengths), np.nan)
+    nonempty = lengths > 0
+    starts = segment_starts(lengths)[nonempty]
+    lengths = lengths[nonempty]
+    position = q * (lengths - 1)
+    lo = np.floor(position).astype(np.int64)
+    hi = np.minimum(lo + 1, lengths - 1)
+    fraction = position - lo
+    lo = sorted_values[starts + lo].astype(np.float64)
+    hi = sorted_values[starts + hi].astype(np.float64)
+    result[nonempty] = lo + (hi - lo) * fraction
+    return result
+
+
+def segment_histogram(values, lengths, bins):
+    """Histogram of each segment for the given bin edges. Values outside the edges are ignored.
+    Returns an array of shape (len(lengths), len(bins)-1)."""
+    bins = np.asarray(bins)
+    num_bins = len(bins) - 1
+    bin_idxs = np.searchsorted(bins, values, side="right") - 1
+    bin_idxs[values == bins[-1]] = num_bins - 1  # last bin is closed like in np.histogram
+    valid = (bin_idxs >= 0) & (bin_idxs < num_bins)
+    keys = segment_ids(lengths)[valid] * num_bins + bin_idxs[valid]
+    hist = np.bincount(keys, minlength=len(lengths)*num_bins)
+    return hist.reshape(len(lengths), num_bins)
@@ -0,0 +1,37 @@
+import os
+import re
+
+
+def get_source_frame_idx(patch_file):
+    """Returns the index of the video frame from which a patch was extracted."""
+    return int(re.findall(r'\d+', os.path.basename(patch_file))[0])
+
+
+def get_source_frame_file(dataset_dir, source_frame_idx, ir_or_rgb):
+    if ir_or_rgb == "ir":
+        return os.path.join(dataset_dir, "splitted", "radiometric", "frame_{:06d}.tiff".format(source_frame_idx))
+    elif ir_or_rgb == "rgb":
+        return os.path.join(dataset_dir, "splitted", "rgb", "frame_{:06d}.jpg".format(source_frame_idx))
+    raise RuntimeError("Unknown whether this is an IR or RGB dataset.")
+
+
+def read_source_frame(dataset_dir, source_frame_idx, ir_or_rgb, frame_cache=None):
+    """Reads a source frame, i.e. the raw uint16 values of an IR frame or the BGR image of an RGB frame.
+    Decoded frames are kept read-only in `frame_cache` (see `LRUCache`) if provided."""
+    key = (dataset_dir, ir_or_rgb, source_frame_idx)
+    if frame_cache is not None:
+        source_frame = frame_cache.get(key)
+        if source_frame is not None:
+            return source_frame
+
+    import cv2
+    source_frame_file = get_source_frame_file(dataset_dir, source_frame_idx, ir_or_rgb)
+    if ir_or_rgb == "ir":
+        source_frame = cv2.imread(source_frame_file, cv2.IMREAD_ANYDEPTH)
+    else:
+        source_frame = cv2.imread(source_frame_file, cv2.IMREAD_COLOR)
+
+    if source_frame is not None and frame_cache is not None:
+        source_frame.flags.writeable = False
+        frame_cache.put(key, source_frame)
+    return source_frame